@@ -13,14 +13,334 @@
 from django.core.files.storage import Storage
 from django.core.files import File
 
-from pygit2 import Repository, init_repository, Signature, GitError, Tree
+from pygit2 import Repository, init_repository, Signature, GitError, Oid
 from pygit2 import GIT_STATUS_INDEX_DELETED, GIT_STATUS_INDEX_MODIFIED, GIT_STATUS_INDEX_NEW
 from pygit2 import GIT_STATUS_WT_DELETED, GIT_STATUS_WT_MODIFIED, GIT_STATUS_WT_NEW
 from pygit2 import GIT_SORT_TIME
 
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict, namedtuple
+
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+import threading
 import datetime
+import time
+import base64
+import binascii
+import hashlib
+import heapq
+import json
 import os
 import re
+import struct
+import zlib
+
+try:
+    import fcntl
+
+except ImportError:
+    fcntl = None
+
+
+# File modes of a directory and of a regular file in a Git tree
+GIT_FILEMODE_TREE = 0o040000
+GIT_FILEMODE_BLOB = 0o100644
+
+# A blob is considered binary if a NUL byte is found in its first bytes
+BINARY_CHECK_SIZE = 8000
+
+# Size of the chunks read from loose objects
+CHUNK_SIZE = 64 * 2 ** 10
+
+# Branch updated by commits
+BRANCH = 'refs/heads/master'
+
+# Number of attempts to commit on top of a branch moving concurrently
+COMMIT_RETRIES = 10
+
+
+def to_unicode(path):
+    """
+        Decode a path returned by pygit2 or the filesystem.
+
+        :param path: The path to decode.
+        :type path: str or unicode
+        :returns: unicode
+    """
+
+    if isinstance(path, bytes):
+        return path.decode('utf-8')
+
+    return path
+
+
+def to_bytes(text):
+    """
+        Encode a text to UTF-8.
+
+        :param text: The text to encode.
+        :type text: str or unicode
+        :returns: str
+    """
+
+    if isinstance(text, bytes):
+        return text
+
+    return text.encode('utf-8')
+
+
+def is_tree_entry(entry):
+    """
+        Check if a tree entry refers to a directory.
+
+        :param entry: The entry to check.
+        :type entry: pygit2.TreeEntry or None
+        :returns: True, False
+    """
+
+    return entry is not None and entry.filemode == GIT_FILEMODE_TREE
+
+
+def to_tree_item(entry):
+    """
+        Describe a tree entry, without its size.
+
+        :param entry: The entry to describe.
+        :type entry: pygit2.TreeEntry or None
+        :returns: TreeItem, or None
+    """
+
+    if entry is None:
+        return None
+
+    return TreeItem(
+        'tree' if is_tree_entry(entry) else 'blob',
+        entry.hex,
+        entry.filemode,
+        None
+    )
+
+
+def guess_mimetype(name):
+    """
+        Guess the mimetype of a file from its name.
+
+        :param name: File name.
+        :type name: unicode
+        :returns: str
+    """
+
+    import urllib
+    import mimetypes
+
+    url = urllib.pathname2url(name.encode('utf-8'))
+
+    return mimetypes.guess_type(url)[0] or 'unknown'
+
+
+def get_tree_entry(tree, name):
+    """
+        Get an entry of a tree, without raising an error.
+
+        :param tree: The tree containing the entry.
+        :type tree: pygit2.Tree or None
+        :param name: Name of the entry within the tree.
+        :type name: unicode
+        :returns: pygit2.TreeEntry or None
+    """
+
+    if tree is None:
+        return None
+
+    try:
+        return tree[name]
+
+    except KeyError:
+        return None
+
+
+def path_changed(repo, atree, btree, name):
+    """
+        Check if a path differs between two trees.
+
+        Only the entries along the path are compared, level by level, so
+        unrelated subtrees are never loaded.
+
+        :param repo: The repository containing the trees.
+        :type repo: pygit2.Repository
+        :param atree: First tree (or None for an empty tree).
+        :type atree: pygit2.Tree or None
+        :param btree: Second tree (or None for an empty tree).
+        :type btree: pygit2.Tree or None
+        :param name: Path within the trees.
+        :type name: unicode
+        :returns: True, False
+    """
+
+    parts = name.split(u'/')
+
+    for depth, part in enumerate(parts):
+        # Identical trees: nothing changed below
+        if atree is not None and btree is not None and atree.hex == btree.hex:
+            return False
+
+        aentry = get_tree_entry(atree, part)
+        bentry = get_tree_entry(btree, part)
+
+        if aentry is None and bentry is None:
+            return False
+
+        elif aentry is None or bentry is None:
+            return True
+
+        elif aentry.hex == bentry.hex:
+            return False
+
+        # The last part of the path has a different object id
+        elif depth == len(parts) - 1:
+            return True
+
+        atree = repo[aentry.oid] if is_tree_entry(aentry) else None
+        btree = repo[bentry.oid] if is_tree_entry(bentry) else None
+
+    return False
+
+
+def tree_changes(repo, atree, btree, prefix=u''):
+    """
+        Get the paths of files which differ between two trees.
+
+        Subtrees with the same object id are skipped.
+
+        :param repo: The repository containing the trees.
+        :type repo: pygit2.Repository
+        :param atree: First tree (or None for an empty tree).
+        :type atree: pygit2.Tree or None
+        :param btree: Second tree (or None for an empty tree).
+        :type btree: pygit2.Tree or None
+        :param prefix: Path of the trees within the repository.
+        :type prefix: unicode
+        :returns: set of unicode
+    """
+
+    paths = set()
+
+    if atree is not None and btree is not None and atree.hex == btree.hex:
+        return paths
+
+    aentries = dict((to_unicode(e.name), e) for e in atree) if atree is not None else {}
+    bentries = dict((to_unicode(e.name), e) for e in btree) if btree is not None else {}
+
+    for name in set(aentries) | set(bentries):
+        aentry = aentries.get(name)
+        bentry = bentries.get(name)
+
+        if aentry is not None and bentry is not None and aentry.hex == bentry.hex:
+            continue
+
+        path = u'{0}{1}'.format(prefix, name)
+
+        # Recurse in subtrees, and consider blobs as changed files
+        asubtree = repo[aentry.oid] if is_tree_entry(aentry) else None
+        bsubtree = repo[bentry.oid] if is_tree_entry(bentry) else None
+
+        if asubtree is not None or bsubtree is not None:
+            paths |= tree_changes(repo, asubtree, bsubtree, u'{0}/'.format(path))
+
+        if (aentry is not None and not is_tree_entry(aentry)) or \
+                (bentry is not None and not is_tree_entry(bentry)):
+            paths.add(path)
+
+    return paths
+
+
+def build_tree(repo, tree, changes):
+    """
+        Write a new tree, made of a tree and some changes.
+
+        Only the subtrees containing changes are rebuilt, the other entries
+        are copied from the base tree.
+
+        :param repo: The repository containing the tree.
+        :type repo: pygit2.Repository
+        :param tree: Base tree (or None for an empty tree).
+        :type tree: pygit2.Tree or None
+        :param changes: Blob of each changed path, relative to the tree (None for a deleted path).
+        :type changes: dict of pygit2.Oid
+        :returns: pygit2.Oid of the new tree, or None if the tree is empty.
+    """
+
+    builder = repo.TreeBuilder(tree) if tree is not None else repo.TreeBuilder()
+    names = set(to_unicode(entry.name) for entry in tree) if tree is not None else set()
+
+    subchanges = {}
+
+    for path, oid in changes.items():
+        name, sep, subpath = path.partition(u'/')
+
+        # Changes in subdirectories are applied recursively
+        if sep:
+            subchanges.setdefault(name, {})[subpath] = oid
+            continue
+
+        entry = get_tree_entry(tree, name)
+
+        if oid is None:
+            if entry is not None:
+                builder.remove(name)
+                names.discard(name)
+
+        else:
+            # Keep the mode of an existing file (executable, symlink)
+            if entry is not None and not is_tree_entry(entry):
+                mode = entry.filemode
+
+            else:
+                mode = GIT_FILEMODE_BLOB
+
+            builder.insert(name, oid, mode)
+            names.add(name)
+
+    for name, subchange in subchanges.items():
+        entry = get_tree_entry(tree, name)
+        subtree = repo[entry.oid] if is_tree_entry(entry) else None
+
+        oid = build_tree(repo, subtree, subchange)
+
+        # Git doesn't store empty directories
+        if oid is None:
+            if entry is not None:
+                builder.remove(name)
+                names.discard(name)
+
+        else:
+            builder.insert(name, oid, GIT_FILEMODE_TREE)
+            names.add(name)
+
+    if not names:
+        return None
+
+    return builder.write()
+
+
+def format_diff_line(line):
+    """
+        Format a line of a diff hunk, as in a patch.
+
+        :param line: Origin and content of the line.
+        :type line: tuple of unicode
+        :returns: unicode
+    """
+
+    origin, content = line
+
+    # Markers (no newline at end of file) are only made of their content
+    if origin in (u'+', u'-', u' '):
+        return u'{0}{1}'.format(origin, content)
+
+    return content
 
 
 class GitFile(File):
@@ -30,107 +350,2177 @@ class GitFile(File):
         """
             Write UTF-8 data to file.
 
-            :param data: Data to write
-            :type data: unicode
+            :param data: Data to write
+            :type data: unicode
+        """
+
+        super(GitFile, self).write(data.encode('utf-8'))
+
+
+class GitBlobFile(File):
+    """
+        Read-only file backed by the buffer of a blob.
+
+        The content is accessed through a memoryview, so seeking and reading
+        never copy more than the requested bytes. If the blob doesn't
+        implement the buffer protocol, its data is copied once.
+    """
+
+    def __init__(self, blob, name=None):
+        """
+            Initialize file on a blob.
+
+            :param blob: The blob to read.
+            :type blob: pygit2.Blob
+            :param name: Name of the file within the repository.
+            :type name: unicode
+        """
+
+        super(GitBlobFile, self).__init__(None, name=name)
+
+        try:
+            self.buffer = memoryview(blob)
+
+        except TypeError:
+            self.buffer = memoryview(blob.data)
+
+        self.blob = blob
+        self.mode = 'rb'
+        self.position = 0
+        self.size = len(self.buffer)
+
+    @property
+    def closed(self):
+        return self.buffer is None
+
+    def getbuffer(self):
+        """
+            Get a read-only view on the whole content, without copy.
+
+            :returns: memoryview
+        """
+
+        return self.buffer
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+            Change the current position.
+
+            :param offset: The new position, relative to ``whence``.
+            :type offset: int
+            :param whence: ``os.SEEK_SET`` (default), ``os.SEEK_CUR`` or ``os.SEEK_END``.
+            :type whence: int
+            :returns: int
+        """
+
+        if whence == os.SEEK_CUR:
+            offset = self.position + offset
+
+        elif whence == os.SEEK_END:
+            offset = len(self.buffer) + offset
+
+        self.position = max(0, offset)
+
+        return self.position
+
+    def read(self, size=-1):
+        """
+            Read at most ``size`` bytes from the current position.
+
+            :param size: Number of bytes to read (default: -1, to read until the end).
+            :type size: int
+            :returns: str
+        """
+
+        start = min(self.position, len(self.buffer))
+
+        if size is None or size < 0:
+            end = len(self.buffer)
+
+        else:
+            end = min(start + size, len(self.buffer))
+
+        self.position = end
+
+        return self.buffer[start:end].tobytes()
+
+    def readinto(self, b):
+        """
+            Read bytes into a pre-allocated buffer.
+
+            :param b: Writable buffer.
+            :type b: bytearray or memoryview
+            :returns: Number of bytes read.
+        """
+
+        data = self.buffer[self.position:self.position + len(b)]
+        n = len(data)
+
+        memoryview(b)[:n] = data
+        self.position += n
+
+        return n
+
+    def chunks(self, chunk_size=None):
+        """
+            Read the file by chunks, from the beginning.
+
+            :param chunk_size: Size of each chunk (default: ``File.DEFAULT_CHUNK_SIZE``).
+            :type chunk_size: int
+            :returns: generator of str
+        """
+
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+
+        for start in range(0, len(self.buffer), chunk_size):
+            self.position = min(start + chunk_size, len(self.buffer))
+
+            yield self.buffer[start:self.position].tobytes()
+
+    def open(self, mode=None):
+        self.seek(0)
+
+    def close(self):
+        self.buffer = None
+        self.blob = None
+
+
+class GitStagedFile(GitFile):
+    """ File written in memory, and staged in the storage when closed. """
+
+    def __init__(self, storage, name, data=b''):
+        """
+            Initialize in-memory file.
+
+            :param storage: The storage where the file is staged.
+            :type storage: GitStorage
+            :param name: Name of the file within the repository.
+            :type name: unicode
+            :param data: Initial content of the file.
+            :type data: str
+        """
+
+        f = BytesIO(data)
+        f.seek(0, os.SEEK_END)
+
+        super(GitStagedFile, self).__init__(f, name=name)
+
+        self.storage = storage
+
+    def close(self):
+        """
+            Stage the content of the file, and close it.
+        """
+
+        if not self.file.closed:
+            self.storage.stage(self.name, self.file.getvalue())
+
+        super(GitStagedFile, self).close()
+
+
+class HistoryIndex(object):
+    """
+        Persistent index of the commits touching each path of the repository.
+
+        The index is stored in the ``gitstorage`` directory of the repository,
+        and is updated incrementally from the last indexed commit to the
+        current HEAD. Each update appends one JSON record, holding the new
+        HEAD and the paths changed by each new commit.
+    """
+
+    def __init__(self, repo):
+        """
+            Initialize the index, the data are loaded lazily.
+
+            :param repo: The repository to index.
+            :type repo: pygit2.Repository
+        """
+
+        self.repo = repo
+        self.filename = os.path.join(repo.path, 'gitstorage', 'history-index')
+        self.file = RecordFile(self.filename)
+
+        self.head = None
+
+        # SHA of the commits touching each path, from the oldest to the newest
+        self.paths = None
+
+        # Position of each indexed commit, the same commit can be indexed
+        # concurrently by several processes.
+        self.order = None
+
+    def reset(self):
+        """
+            Initialize an empty index.
+        """
+
+        self.head = None
+        self.paths = {}
+        self.order = {}
+
+    def parse(self, data):
+        """
+            Add records to the index.
+
+            :param data: Records, from the oldest to the newest.
+            :type data: bytes
+            :returns: int, the size of the complete records.
+        """
+
+        return parse_json_lines(data, self.add)
+
+    def add(self, record):
+        """
+            Add a record to the index.
+
+            :param record: The HEAD, and the paths changed by each commit from the oldest to the newest.
+            :type record: dict
+        """
+
+        for sha, paths in record['commits']:
+            if sha in self.order:
+                continue
+
+            self.order[sha] = len(self.order)
+
+            for path in paths:
+                self.paths.setdefault(path, []).append(sha)
+
+        self.head = record['head']
+
+    def load(self):
+        """
+            Load the index from disk, or initialize an empty index.
+        """
+
+        self.file.read(self.parse, self.reset)
+
+    def exists(self):
+        """
+            Check if the index was already built.
+
+            :returns: True, False
+        """
+
+        return self.paths is not None or self.file.exists()
+
+    def changed_paths(self, commit):
+        """
+            Get paths modified by a commit, compared to its first parent.
+
+            :param commit: The commit to inspect.
+            :type commit: pygit2.Commit
+            :returns: set of unicode
+        """
+
+        parent = commit.parents[0].tree if commit.parents else None
+
+        return tree_changes(self.repo, commit.tree, parent)
+
+    def update(self):
+        """
+            Index commits between the last indexed commit and HEAD.
+        """
+
+        if self.paths is None:
+            self.load()
+
+        if self.repo.head_is_orphaned:
+            return
+
+        head = self.repo.head.hex
+
+        if head == self.head:
+            return
+
+        walker = self.repo.walk(self.repo.head.oid, GIT_SORT_TIME)
+        rebuild = False
+
+        if self.head is not None:
+            try:
+                walker.hide(self.head)
+
+            # The last indexed commit disappeared, rebuild the whole index
+            except (KeyError, ValueError, GitError):
+                rebuild = True
+
+        # Commits are walked from the newest to the oldest, and are written
+        # after the already indexed (and older) commits.
+        commits = [[commit.hex, sorted(self.changed_paths(commit))] for commit in walker]
+        commits.reverse()
+
+        record = json.dumps({'head': head, 'commits': commits}).encode('utf-8') + b'\n'
+
+        if rebuild:
+            self.file.rewrite(record, self.parse, self.reset)
+
+        else:
+            self.file.append(record, self.parse, self.reset)
+
+    def commits(self, name):
+        """
+            Get SHA of commits touching a file or a directory, from the newest to the oldest.
+
+            :param name: File name within the repository.
+            :type name: unicode
+            :returns: list of unicode
+        """
+
+        self.update()
+
+        if name in self.paths:
+            return list(reversed(self.paths[name]))
+
+        # Only files are indexed, a directory is touched by the commits of
+        # the files below it.
+        prefix = u'{0}/'.format(name.strip(u'/'))
+        shas = set()
+
+        for path, pshas in self.paths.items():
+            if path.startswith(prefix):
+                shas.update(pshas)
+
+        return sorted(shas, key=self.order.get, reverse=True)
+
+
+# Description of a path within the HEAD tree
+TreeItem = namedtuple('TreeItem', ['type', 'sha', 'mode', 'size'])
+
+# File of the index, or of the HEAD tree in a bare repository
+IndexItem = namedtuple('IndexItem', ['path', 'hex'])
+
+# Metadata of a path, returned by GitStorage.stat_many()
+FileStat = namedtuple('FileStat', ['type', 'size', 'sha', 'mode', 'mtime', 'mimetype'])
+
+
+class FileLock(object):
+    """
+        Lock shared by the processes using a repository.
+
+        The lock is held with ``flock()`` where available, otherwise by
+        creating the lock file exclusively.
+    """
+
+    def __init__(self, filename, timeout=10.0):
+        """
+            Initialize lock.
+
+            :param filename: Path of the lock file.
+            :type filename: str
+            :param timeout: Maximal number of seconds to wait for the lock, without ``flock()``.
+            :type timeout: float
+        """
+
+        self.filename = filename
+        self.timeout = timeout
+        self.fd = None
+
+    def __enter__(self):
+        dirname = os.path.dirname(self.filename)
+
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+
+            # Created concurrently
+            except OSError:
+                pass
+
+        if fcntl is not None:
+            self.fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+        else:
+            deadline = time.time() + self.timeout
+
+            while True:
+                try:
+                    self.fd = os.open(self.filename, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+                    break
+
+                except OSError:
+                    if time.time() > deadline:
+                        raise IOError(u"{0}: Lock timeout".format(self.filename))
+
+                    time.sleep(0.01)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+
+        else:
+            os.close(self.fd)
+            os.remove(self.filename)
+
+        self.fd = None
+
+        return False
+
+
+def parse_json_lines(data, callback):
+    """
+        Read JSON records, one per line.
+
+        :param data: Records to read.
+        :type data: bytes
+        :param callback: Function called with each record.
+        :type callback: callable
+        :returns: int, the size of the complete lines.
+    """
+
+    pos = 0
+
+    while True:
+        end = data.find(b'\n', pos)
+
+        # Incomplete record, being written by another process
+        if end < 0:
+            return pos
+
+        try:
+            record = json.loads(data[pos:end].decode('utf-8'))
+
+        # Unreadable record, its data are written again
+        except ValueError:
+            record = None
+
+        if record is not None:
+            callback(record)
+
+        pos = end + 1
+
+
+class RecordFile(object):
+    """
+        File of records shared by the processes using a repository.
+
+        Records are appended while holding a lock, after reading the records
+        appended by other processes, and after truncating the incomplete
+        record of an interrupted process. Readers don't need the lock, since
+        they only read complete records.
+    """
+
+    def __init__(self, filename, header=b''):
+        """
+            Initialize the file, nothing is read yet.
+
+            :param filename: Path of the file.
+            :type filename: str
+            :param header: Data starting the file, identifying its format.
+            :type header: bytes
+        """
+
+        self.filename = filename
+        self.lockname = '{0}.lock'.format(filename)
+        self.header = header
+
+        # Position of the end of the last complete record read, and inode of
+        # the file read.
+        self.end = None
+        self.inode = None
+
+    def exists(self):
+        """
+            Check if the file was already written.
+
+            :returns: True, False
+        """
+
+        return os.path.exists(self.filename)
+
+    def sync(self, f, parse, reset):
+        """
+            Read the records written since the file was last read.
+
+            :param f: The opened file.
+            :type f: file
+            :param parse: Function reading records, and returning the size of the complete records.
+            :type parse: callable
+            :param reset: Function forgetting the records read.
+            :type reset: callable
+            :returns: int, the position of the end of the last complete record.
+        """
+
+        stat = os.fstat(f.fileno())
+
+        # The file was rewritten, read it again
+        if self.end is None or stat.st_ino != self.inode or stat.st_size < self.end:
+            reset()
+
+            self.end = 0
+            self.inode = stat.st_ino
+
+        f.seek(self.end)
+        data = f.read()
+
+        if self.end == 0:
+            # Unknown format, the file is written again
+            if not data.startswith(self.header) or not data:
+                return 0
+
+            self.end = len(self.header)
+            data = data[len(self.header):]
+
+        self.end += parse(data)
+
+        return self.end
+
+    def read(self, parse, reset):
+        """
+            Read the whole file.
+
+            :param parse: Function reading records, and returning the size of the complete records.
+            :type parse: callable
+            :param reset: Function forgetting the records read.
+            :type reset: callable
+        """
+
+        self.end = None
+
+        try:
+            with open(self.filename, 'rb') as f:
+                self.sync(f, parse, reset)
+
+        except (IOError, OSError):
+            reset()
+
+            self.end = None
+            self.inode = None
+
+    def append(self, data, parse, reset):
+        """
+            Append records to the file, and read them.
+
+            :param data: Records to append.
+            :type data: bytes
+            :param parse: Function reading records, and returning the size of the complete records.
+            :type parse: callable
+            :param reset: Function forgetting the records read.
+            :type reset: callable
+        """
+
+        with FileLock(self.lockname):
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+
+            with os.fdopen(fd, 'r+b') as f:
+                end = self.sync(f, parse, reset)
+
+                # Forget the incomplete record of an interrupted process
+                f.seek(end)
+                f.truncate()
+
+                if end == 0:
+                    f.write(self.header)
+                    end = len(self.header)
+
+                f.write(data)
+
+        self.end = end + parse(data)
+
+    def rewrite(self, data, parse, reset):
+        """
+            Replace the records of the file, and read them.
+
+            :param data: Records to write.
+            :type data: bytes
+            :param parse: Function reading records, and returning the size of the complete records.
+            :type parse: callable
+            :param reset: Function forgetting the records read.
+            :type reset: callable
+        """
+
+        with FileLock(self.lockname):
+            # Write in a temporary file first, so a concurrent reader never
+            # sees a partial file.
+            tmpname = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+
+            with open(tmpname, 'wb') as f:
+                f.write(self.header)
+                f.write(data)
+
+            os.rename(tmpname, self.filename)
+
+            self.inode = os.stat(self.filename).st_ino
+
+        reset()
+
+        self.end = len(self.header) + parse(data)
+
+
+class LRUCache(object):
+    """ Bounded, thread-safe, mapping evicting the least recently used keys. """
+
+    def __init__(self, size, weight=None):
+        """
+            Initialize an empty cache.
+
+            :param size: Maximal number of keys in the cache.
+            :type size: int
+            :param weight: Maximal total length of the values in the cache (default: None, for no limit).
+            :type weight: int or None
+        """
+
+        self.size = size
+        self.weight = weight
+        self.total = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """
+            Get a value from the cache.
+
+            :param key: Key of the value.
+            :param default: Value returned if the key isn't in the cache.
+            :returns: The cached value, or default.
+        """
+
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+
+            except KeyError:
+                return default
+
+            # Mark the key as the most recently used
+            self.data[key] = value
+
+            return value
+
+    def set(self, key, value):
+        """
+            Put a value in the cache, and evict the least recently used keys.
+
+            :param key: Key of the value.
+            :param value: Value to cache.
+        """
+
+        with self.lock:
+            self.remove(key)
+
+            # A value larger than the cache is not cached
+            if self.weight is not None and len(value) > self.weight:
+                return
+
+            self.data[key] = value
+
+            if self.weight is not None:
+                self.total += len(value)
+
+            while len(self.data) > self.size or (self.weight is not None and self.total > self.weight):
+                self.remove(next(iter(self.data)))
+
+    def remove(self, key):
+        """
+            Remove a key from the cache, the lock must be held.
+
+            :param key: Key of the value.
+        """
+
+        try:
+            value = self.data.pop(key)
+
+        except KeyError:
+            return
+
+        if self.weight is not None:
+            self.total -= len(value)
+
+    def clear(self):
+        """
+            Remove every key from the cache.
+        """
+
+        with self.lock:
+            self.data.clear()
+            self.total = 0
+
+
+class CommitGraph(object):
+    """
+        Persistent graph of the commits of the repository.
+
+        For each commit, the graph stores its parents, its time and its
+        generation number (1 for a root commit, 1 + the maximal generation
+        of its parents otherwise), so history can be walked without loading
+        commit objects.
+
+        The graph is stored in the ``gitstorage`` directory of the
+        repository as a header followed by one record per commit, records
+        are appended as new commits are indexed.
+    """
+
+    MAGIC = b'GSCG\x01'
+
+    # SHA, time, generation, number of parents, followed by the parents' SHA
+    RECORD = struct.Struct('>20sqiH')
+
+    def __init__(self, repo):
+        """
+            Initialize the graph, the data are loaded lazily.
+
+            :param repo: The repository to index.
+            :type repo: pygit2.Repository
+        """
+
+        self.repo = repo
+        self.filename = os.path.join(repo.path, 'gitstorage', 'commit-graph')
+        self.file = RecordFile(self.filename, self.MAGIC)
+
+        self.commits = None
+
+    def reset(self):
+        """
+            Initialize an empty graph.
+        """
+
+        self.commits = {}
+
+    def parse(self, data):
+        """
+            Add records to the graph.
+
+            :param data: Records, parents before their children.
+            :type data: bytes
+            :returns: int, the size of the complete records.
+        """
+
+        pos = 0
+
+        while pos + self.RECORD.size <= len(data):
+            raw, ctime, generation, count = self.RECORD.unpack_from(data, pos)
+            start = pos + self.RECORD.size
+            end = start + 20 * count
+
+            # Incomplete record, being written by another process
+            if end > len(data):
+                break
+
+            parents = tuple(
+                binascii.hexlify(data[start + 20 * i:start + 20 * (i + 1)]).decode('ascii')
+                for i in range(count)
+            )
+
+            self.commits[binascii.hexlify(raw).decode('ascii')] = (ctime, generation, parents)
+            pos = end
+
+        return pos
+
+    def load(self):
+        """
+            Load the graph from disk, or initialize an empty graph.
+        """
+
+        self.file.read(self.parse, self.reset)
+
+    def exists(self):
+        """
+            Check if the graph was already built.
+
+            :returns: True, False
+        """
+
+        return self.commits is not None or self.file.exists()
+
+    def update(self, head):
+        """
+            Add a commit and its missing ancestors to the graph.
+
+            :param head: SHA of the commit.
+            :type head: unicode
+        """
+
+        if self.commits is None:
+            self.load()
+
+        if head in self.commits:
+            return
+
+        new = []
+        loaded = {}
+        stack = [head]
+
+        # Add parents before their children, to know their generation
+        while stack:
+            sha = stack[-1]
+
+            if sha in self.commits:
+                stack.pop()
+                continue
+
+            if sha not in loaded:
+                commit = self.repo[sha]
+                loaded[sha] = (commit.commit_time, tuple(p.hex for p in commit.parents))
+
+            ctime, parents = loaded[sha]
+            missing = [p for p in parents if p not in self.commits]
+
+            if missing:
+                stack.extend(missing)
+                continue
+
+            generation = 1 + max([self.commits[p][1] for p in parents] or [0])
+
+            self.commits[sha] = (ctime, generation, parents)
+            new.append(sha)
+
+            stack.pop()
+
+        self.dump(new)
+
+    def dump(self, shas):
+        """
+            Append commits to the graph on disk.
+
+            :param shas: SHA of the commits to write.
+            :type shas: list of unicode
+        """
+
+        records = []
+
+        for sha in shas:
+            ctime, generation, parents = self.commits[sha]
+
+            records.append(self.RECORD.pack(
+                binascii.unhexlify(sha), ctime, generation, len(parents)
+            ))
+            records.extend(binascii.unhexlify(p) for p in parents)
+
+        self.file.append(b''.join(records), self.parse, self.reset)
+
+    def walk(self, starts):
+        """
+            Walk history from some commits, from the newest to the oldest.
+
+            :param starts: SHA of the commits to start from.
+            :type starts: list of unicode
+            :returns: generator of unicode
+        """
+
+        for sha in starts:
+            self.update(sha)
+
+        heap = []
+        seen = set()
+
+        for sha in starts:
+            if sha not in seen:
+                seen.add(sha)
+                heapq.heappush(heap, (-self.commits[sha][0], -self.commits[sha][1], sha))
+
+        while heap:
+            _, _, sha = heapq.heappop(heap)
+
+            yield sha
+
+            for parent in self.commits[sha][2]:
+                if parent not in seen:
+                    seen.add(parent)
+
+                    # The graph was rebuilt by another process
+                    if parent not in self.commits:
+                        self.update(parent)
+
+                    heapq.heappush(heap, (-self.commits[parent][0], -self.commits[parent][1], parent))
+
+
+class SearchQuery(object):
+    """
+        Search query, compiled once and matched against many blobs.
+
+        A query is made of one or several patterns, which are either plain
+        strings, matched against the raw bytes of the blobs, or regular
+        expressions, matched against the decoded text.
+    """
+
+    def __init__(self, pattern, regex=False):
+        """
+            Compile the query.
+
+            :param pattern: Pattern, or list of patterns, to search.
+            :type pattern: unicode or list of unicode
+            :param regex: Patterns are regular expressions (default: False).
+            :type regex: bool
+        """
+
+        if isinstance(pattern, (list, tuple)):
+            self.patterns = [to_unicode(p) for p in pattern]
+
+        else:
+            self.patterns = [to_unicode(pattern)]
+
+        self.regex = regex
+        self.needle = None
+        self.compiled = None
+
+        # Identify the query in the search cache
+        self.key = (tuple(self.patterns), regex)
+
+        if regex:
+            # Find every pattern in a single pass with an alternation
+            self.compiled = re.compile(
+                u'|'.join(u'(?:{0})'.format(p) for p in self.patterns),
+                re.UNICODE | re.MULTILINE
+            )
+
+        elif len(self.patterns) == 1:
+            # A single string is found with bytes.find()
+            self.needle = to_bytes(self.patterns[0])
+
+        else:
+            self.compiled = re.compile(
+                b'|'.join(re.escape(to_bytes(p)) for p in self.patterns)
+            )
+
+    def find(self, data, pos):
+        """
+            Find the next match in data.
+
+            :param data: Data to search.
+            :type data: str or unicode
+            :param pos: Position where the search starts.
+            :type pos: int
+            :returns: Position of the match, or -1
+        """
+
+        if self.compiled is None:
+            return data.find(self.needle, pos)
+
+        match = self.compiled.search(data, pos)
+
+        return match.start() if match else -1
+
+    def lines(self, data, max_lines=None):
+        """
+            Get lines of data containing a match.
+
+            :param data: Raw content of a blob.
+            :type data: str
+            :param max_lines: Maximal number of matched lines to get (default: None, to get all).
+            :type max_lines: int or None
+            :returns: list of unicode
+        """
+
+        # Skip binary blobs
+        if b'\0' in data[:BINARY_CHECK_SIZE]:
+            return []
+
+        try:
+            # Regular expressions are matched against the text, plain
+            # strings against the raw data.
+            if self.regex:
+                data = data.decode('utf-8')
+
+            lines = []
+
+            # Look for a match, and decode only matched lines
+            pos = self.find(data, 0)
+
+            while pos != -1 and pos < len(data):
+                start = data.rfind(u'\n' if self.regex else b'\n', 0, pos) + 1
+                end = data.find(u'\n' if self.regex else b'\n', pos)
+
+                if end == -1:
+                    end = len(data)
+
+                line = data[start:end].rstrip(u'\r' if self.regex else b'\r')
+                lines.append(to_unicode(line))
+
+                if len(lines) == max_lines:
+                    break
+
+                # Continue after the matched line
+                pos = self.find(data, end + 1)
+
+            return lines
+
+        # Not a text file
+        except UnicodeDecodeError:
+            return []
+
+    def candidates(self, index):
+        """
+            Get SHA of blobs which may match the query.
+
+            :param index: The search index.
+            :type index: SearchIndex
+            :returns: set of unicode, or None if every blob is a candidate.
+        """
+
+        # The trigram index can't be used for regular expressions
+        if self.regex:
+            return None
+
+        candidates = set()
+
+        for pattern in self.patterns:
+            shas = index.candidates(pattern)
+
+            if shas is None:
+                return None
+
+            candidates |= shas
+
+        return candidates
+
+
+class SearchIndex(object):
+    """
+        Persistent trigram index of the blobs of the repository.
+
+        The index maps each blob SHA to the trigrams of its raw content, as
+        plain patterns are matched against raw bytes, and is
+        stored in the ``gitstorage`` directory of the repository as one JSON
+        record per blob. Blobs are immutable, so records of new blobs are
+        appended, and removed blobs are only forgotten when they outnumber
+        the searched ones.
+    """
+
+    def __init__(self, repo):
+        """
+            Initialize the index, the data are loaded lazily.
+
+            :param repo: The repository to index.
+            :type repo: pygit2.Repository
+        """
+
+        self.repo = repo
+        self.filename = os.path.join(repo.path, 'gitstorage', 'search-index')
+        self.file = RecordFile(self.filename)
+
+        self.blobs = None
+        self.postings = None
+
+    @staticmethod
+    def trigrams(data):
+        """
+            Get the set of trigrams of some data.
+
+            :param data: Data to split.
+            :type data: str
+            :returns: set of str
+        """
+
+        return set(data[i:i + 3] for i in range(len(data) - 2))
+
+    def reset(self):
+        """
+            Initialize an empty index.
+        """
+
+        self.blobs = {}
+        self.postings = {}
+
+    def parse(self, data):
+        """
+            Add records to the index.
+
+            :param data: Records, one per blob.
+            :type data: bytes
+            :returns: int, the size of the complete records.
+        """
+
+        return parse_json_lines(data, self.add)
+
+    def add(self, record):
+        """
+            Add a record to the index.
+
+            :param record: SHA and trigrams of a blob, encoded in base64.
+            :type record: list
+        """
+
+        sha, encoded = record
+
+        if sha in self.blobs:
+            return
+
+        data = base64.b64decode(encoded.encode('ascii'))
+        trigrams = [data[i:i + 3] for i in range(0, len(data), 3)]
+
+        for trigram in trigrams:
+            self.postings.setdefault(trigram, set()).add(sha)
+
+        self.blobs[sha] = trigrams
+
+    def load(self):
+        """
+            Load the index from disk, or initialize an empty index.
+        """
+
+        self.file.read(self.parse, self.reset)
+
+    def dump(self, blobs):
+        """
+            Encode blobs as records.
+
+            :param blobs: SHA and trigrams of each blob.
+            :type blobs: list of tuple
+            :returns: bytes
+        """
+
+        return b''.join(
+            json.dumps([
+                sha,
+                base64.b64encode(b''.join(sorted(trigrams))).decode('ascii')
+            ]).encode('utf-8') + b'\n'
+            for sha, trigrams in blobs
+        )
+
+    def exists(self):
+        """
+            Check if the index was already built.
+
+            :returns: True, False
+        """
+
+        return self.blobs is not None or self.file.exists()
+
+    def update(self, shas):
+        """
+            Index new blobs.
+
+            :param shas: SHA of the blobs to index.
+            :type shas: iterable of unicode
+        """
+
+        if self.blobs is None:
+            self.load()
+
+        new = []
+
+        for sha in set(shas):
+            if sha in self.blobs:
+                continue
+
+            data = self.repo[sha].data
+
+            # Binary blobs are never searched
+            if b'\0' in data[:BINARY_CHECK_SIZE]:
+                data = b''
+
+            new.append((sha, self.trigrams(data)))
+
+        if new:
+            self.file.append(self.dump(new), self.parse, self.reset)
+
+    def prune(self, shas):
+        """
+            Forget blobs which are no longer searched, once they outnumber the searched ones.
+
+            :param shas: SHA of the blobs to search.
+            :type shas: set of unicode
+        """
+
+        if self.blobs is None:
+            self.load()
+
+        removed = [sha for sha in self.blobs if sha not in shas]
+
+        if len(removed) <= len(self.blobs) - len(removed):
+            return
+
+        blobs = [(sha, trigrams) for sha, trigrams in self.blobs.items() if sha in shas]
+
+        self.file.rewrite(self.dump(blobs), self.parse, self.reset)
+
+    def candidates(self, pattern):
+        """
+            Get SHA of blobs which may contain the pattern.
+
+            :param pattern: Pattern to search.
+            :type pattern: unicode
+            :returns: set of unicode, or None if every blob is a candidate.
+        """
+
+        trigrams = self.trigrams(to_bytes(pattern))
+
+        if not trigrams:
+            return None
+
+        candidates = None
+
+        for trigram in trigrams:
+            shas = self.postings.get(trigram, set())
+            candidates = shas if candidates is None else candidates & shas
+
+            if not candidates:
+                break
+
+        return set(candidates)
+
+
+class GitTransaction(object):
+    """
+        Batch of writes and deletes, committed at once.
+
+        Blobs are written to the object database as files are saved, the
+        tree and the commit are written when the transaction ends without
+        error. The working directory, if any, is then updated.
+    """
+
+    def __init__(self, storage, user, message):
+        """
+            Initialize an empty transaction.
+
+            :param storage: The storage to commit to.
+            :type storage: GitStorage
+            :param user: The commit author/committer.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+        """
+
+        self.storage = storage
+        self.user = user
+        self.message = message
+
+        self.changes = {}
+        self.commit = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Discard the changes on error
+        if exc_type is None:
+            self.apply()
+
+        return False
+
+    def save(self, name, content):
+        """
+            Write a file in the transaction, replacing any existing file.
+
+            :param name: Name of the file within the repository.
+            :type name: unicode
+            :param content: Content to save.
+            :type content: django.core.files.File
+            :returns: unicode
+        """
+
+        try:
+            size = content.size
+
+        except (AttributeError, TypeError, ValueError):
+            size = None
+
+        self.changes[name] = self.storage.write_blob(content.chunks(), size)
+
+        return name
+
+    def delete(self, name):
+        """
+            Delete a file in the transaction.
+
+            :param name: Name of the file within the repository.
+            :type name: unicode
+        """
+
+        self.changes[name] = None
+
+    def apply(self):
+        """
+            Commit the changes of the transaction.
+
+            :returns: pygit2.Commit, or None if there was no change.
+        """
+
+        if not self.changes or self.commit is not None:
+            return self.commit
+
+        self.commit = self.storage.apply_changes(self.user, self.message, self.changes)
+
+        return self.commit
+
+
+class GitCommitTicket(object):
+    """ Pending write of a GitCommitQueue. """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.commit = None
+        self.error = None
+
+    def done(self, commit=None, error=None):
+        """
+            Mark the write as committed (or failed).
+
+            :param commit: The commit containing the write.
+            :type commit: pygit2.Commit or None
+            :param error: The error raised while committing.
+            :type error: Exception or None
+        """
+
+        self.commit = commit
+        self.error = error
+        self.event.set()
+
+    def wait(self, timeout=None):
+        """
+            Wait until the write is committed.
+
+            :param timeout: Maximal number of seconds to wait (default: None, to wait forever).
+            :type timeout: float or None
+            :returns: pygit2.Commit, or None if the timeout expired.
+            :raises: The error raised while committing.
+        """
+
+        self.event.wait(timeout)
+
+        if self.error is not None:
+            raise self.error
+
+        return self.commit
+
+
+class GitCommitQueue(object):
+    """
+        Background committer, grouping writes into fewer commits.
+
+        Writes are queued, and a thread commits them after a short window,
+        with one commit per author. Blobs are written when the writes are
+        queued, so only trees and commits are written by the thread.
+
+        Usage::
+
+            queue = GitCommitQueue(storage)
+
+            ticket = queue.save(user, u'Edit', u'a.txt', ContentFile('a'))
+
+            # Wait for this write only
+            commit = ticket.wait()
+
+            # Or for every queued write
+            queue.flush()
+    """
+
+    def __init__(self, storage, window=0.05):
+        """
+            Initialize an empty queue.
+
+            :param storage: The storage to commit to.
+            :type storage: GitStorage
+            :param window: Number of seconds to wait for more writes before committing (default: 0.05).
+            :type window: float
+        """
+
+        self.storage = storage
+        self.window = window
+
+        self.pending = []
+
+        # Writes of the batch being committed
+        self.committing = []
+
+        self.flushing = False
+        self.closed = False
+
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def save(self, user, message, name, content):
+        """
+            Queue a write.
+
+            :param user: The commit author.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+            :param name: Name of the file within the repository.
+            :type name: unicode
+            :param content: Content to save.
+            :type content: django.core.files.File
+            :returns: GitCommitTicket
+        """
+
+        try:
+            size = content.size
+
+        except (AttributeError, TypeError, ValueError):
+            size = None
+
+        oid = self.storage.write_blob(content.chunks(), size)
+
+        return self.enqueue(user, message, {name: oid})
+
+    def delete(self, user, message, name):
+        """
+            Queue a deletion.
+
+            :param user: The commit author.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+            :param name: Name of the file within the repository.
+            :type name: unicode
+            :returns: GitCommitTicket
+        """
+
+        return self.enqueue(user, message, {name: None})
+
+    def enqueue(self, user, message, changes):
+        """
+            Queue changes.
+
+            :param user: The commit author.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+            :param changes: Blob of each changed path (None for a deleted path).
+            :type changes: dict of pygit2.Oid
+            :returns: GitCommitTicket
+            :raises: ValueError
+        """
+
+        ticket = GitCommitTicket()
+
+        with self.condition:
+            if self.closed:
+                raise ValueError(u"Commit queue is closed")
+
+            self.pending.append((user, message, changes, ticket))
+
+            # Start the committer thread on the first write
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+            self.condition.notify_all()
+
+        return ticket
+
+    def flush(self, timeout=None):
+        """
+            Commit the queued writes now, and wait until they are committed.
+
+            :param timeout: Maximal number of seconds to wait (default: None, to wait forever).
+            :type timeout: float or None
+            :returns: True if every write was committed, False if a write failed or the timeout expired.
+        """
+
+        with self.condition:
+            tickets = [ticket for _, _, _, ticket in self.committing + self.pending]
+
+            # Skip the window of the queued writes only, the next writes are
+            # grouped as usual.
+            if self.pending:
+                self.flushing = True
+                self.condition.notify_all()
+
+        deadline = time.time() + timeout if timeout is not None else None
+
+        for ticket in tickets:
+            remaining = deadline - time.time() if deadline is not None else None
+
+            if remaining is not None and remaining <= 0:
+                return False
+
+            if not ticket.event.wait(remaining):
+                return False
+
+        # The error of a failed write is raised by its ticket
+        return all(ticket.error is None for ticket in tickets)
+
+    def close(self, timeout=None):
+        """
+            Commit the queued writes, and stop the committer thread.
+
+            :param timeout: Maximal number of seconds to wait (default: None, to wait forever).
+            :type timeout: float or None
+        """
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        """
+            Commit queued writes, until the queue is closed.
+        """
+
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+
+                if not self.pending:
+                    return
+
+                # Wait for more writes, unless a flush is requested
+                deadline = time.time() + self.window
+
+                while not self.flushing and not self.closed:
+                    remaining = deadline - time.time()
+
+                    if remaining <= 0:
+                        break
+
+                    self.condition.wait(remaining)
+
+                pending = self.pending
+                self.pending = []
+                self.flushing = False
+
+                # Keep track of the writes until they are committed
+                self.committing = pending
+
+            try:
+                self.commit(pending)
+
+            finally:
+                with self.condition:
+                    self.committing = []
+
+    def commit(self, pending):
+        """
+            Commit writes, with one commit per author.
+
+            :param pending: Queued writes.
+            :type pending: list of tuple
+        """
+
+        groups = OrderedDict()
+
+        for user, message, changes, ticket in pending:
+            key = (user.first_name, user.last_name, user.email)
+            groups.setdefault(key, []).append((user, message, changes, ticket))
+
+        for writes in groups.values():
+            changes = {}
+            messages = []
+
+            # Later writes of a path replace the earlier ones
+            for _, message, wchanges, _ in writes:
+                changes.update(wchanges)
+
+                if message not in messages:
+                    messages.append(message)
+
+            try:
+                commit = self.storage.apply_changes(writes[0][0], u'\n\n'.join(messages), changes)
+
+            except Exception as e:
+                for _, _, _, ticket in writes:
+                    ticket.done(error=e)
+
+            else:
+                for _, _, _, ticket in writes:
+                    ticket.done(commit=commit)
+
+
+class HistoryWalker(object):
+    """
+        Walk history from the newest to the oldest commit, and keep track of
+        the commits left to walk.
+    """
+
+    def __init__(self, storage, starts=None):
+        """
+            Start the walk.
+
+            :param storage: The storage to walk.
+            :type storage: GitStorage
+            :param starts: SHA of the commits to start from (default: None, to start from HEAD).
+            :type starts: list of unicode or None
+        """
+
+        if starts is None:
+            head = storage.head_sha()
+            starts = [head] if head else []
+
+        self.storage = storage
+        self.pending = set(starts)
+        self.walked = set()
+
+        self.iterator = storage.walk_history(list(starts))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        sha = next(self.iterator)
+
+        self.walked.add(sha)
+        self.pending.discard(sha)
+
+        # The parents are now left to walk
+        for parent in self.storage.commit_parents(sha):
+            if parent not in self.walked:
+                self.pending.add(parent)
+
+        return sha
+
+    next = __next__
+
+    def frontier(self):
+        """
+            Get the commits where the walk can be resumed.
+
+            :returns: list of unicode
+        """
+
+        return sorted(self.pending)
+
+
+class GitStorage(Storage):
+    """ Git file storage backend. """
+
+    def __init__(self, path, history_index=True, search_index=True, search_cache_size=4096,
+                 tree_cache_size=65536, listdir_cache_size=1024, commit_graph=True,
+                 diff_cache=None, diff_cache_size=256, diff_cache_weight=64 * 2 ** 20):
+        """
+            Initialize repository.
+
+            :param path: Absolute path to the existing Git repository.
+            :type path: str
+            :param history_index: Use a persistent index to get the history of a file (default: True).
+            :type history_index: bool
+            :param search_index: Use a persistent trigram index to search files (default: True).
+            :type search_index: bool
+            :param search_cache_size: Number of searched blobs to keep in cache (default: 4096, use 0 to disable the cache).
+            :type search_cache_size: int
+            :param tree_cache_size: Number of paths of the HEAD tree to keep in cache (default: 65536).
+            :type tree_cache_size: int
+            :param listdir_cache_size: Number of listed directories to keep in cache (default: 1024).
+            :type listdir_cache_size: int
+            :param commit_graph: Use a persistent commit graph to walk history (default: True).
+            :type commit_graph: bool
+            :param diff_cache: Django cache (or its alias) storing diffs, instead of the process memory (default: None).
+            :type diff_cache: str or django.core.cache.backends.base.BaseCache or None
+            :param diff_cache_size: Number of diffs to keep in process memory, without Django cache (default: 256, use 0 to disable the cache).
+            :type diff_cache_size: int
+            :param diff_cache_weight: Maximal total length of the diffs kept in process memory (default: 64 MiB).
+            :type diff_cache_weight: int
+        """
+
+        super(GitStorage, self).__init__()
+
+        self.repo = Repository(path)
+
+        # A bare repository has no working directory and no index, files are
+        # read from the HEAD tree and writes are staged in memory.
+        self.bare = self.repo.is_bare
+
+        if self.bare:
+            self.index = None
+
+        else:
+            self.index = self.repo.index
+            self.index.read()
+
+        # Blob of each path written since the last commit (None for deleted
+        # paths in a bare repository).
+        self.staged = {}
+        self.staged_lock = threading.Lock()
+
+        # Paths of the working directory written through the storage since
+        # the last commit.
+        self.dirty = set()
+
+        # SHA of the commit the index was last synchronized with, the index
+        # is updated lazily after commits made without it.
+        self.index_head_file = os.path.join(self.repo.path, 'gitstorage', 'index-head')
+        self.index_lock_file = os.path.join(self.repo.path, 'gitstorage', 'index.lock')
+
+        self.history = HistoryIndex(self.repo) if history_index else None
+        self.search_index = SearchIndex(self.repo) if search_index else None
+        self.graph = CommitGraph(self.repo) if commit_graph else None
+
+        # Blobs are immutable, so the lines of a blob matching a query never
+        # need to be invalidated.
+        self.search_cache = LRUCache(search_cache_size) if search_cache_size > 0 else None
+
+        # Entries of the HEAD tree, keyed by HEAD commit SHA and path
+        self.tree_cache = LRUCache(tree_cache_size)
+
+        # Contents of directories, keyed by tree SHA
+        self.listdir_cache = LRUCache(listdir_cache_size)
+
+        # Diffs between commits, keyed by commit SHA and file name
+        if isinstance(diff_cache, (bytes, type(u''))):
+            try:
+                from django.core.cache import caches
+                diff_cache = caches[diff_cache]
+
+            # Django < 1.7
+            except ImportError:
+                from django.core.cache import get_cache
+                diff_cache = get_cache(diff_cache)
+
+        elif diff_cache is None and diff_cache_size > 0:
+            diff_cache = LRUCache(diff_cache_size, diff_cache_weight)
+
+        self.diff_cache = diff_cache
+
+    @classmethod
+    def create_storage(cls, path, bare=False):
+        """
+            Create repository, and return GitStorage object on it
+
+            :param path: Absolute path to the Git repository to create.
+            :type path: str
+            :param bare: Create a bare repository, without working directory (default: False).
+            :type bare: bool
+            :returns: GitStorage
+        """
+
+        init_repository(path, bare)
+
+        return cls(path)
+
+    def commit(self, user, message, full_scan=False):
+        """
+            Save previous changes in a new commit.
+
+            Only the files written through ``save()``, ``open()`` and
+            ``delete()`` are staged. If no such file was written, or if
+            ``full_scan`` is True, the status of the whole working directory
+            is checked instead.
+
+            :param user: The commit author/committer.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+            :param full_scan: Check the status of the whole working directory (default: False).
+            :type full_scan: bool
+            :returns: pygit2.Commit
+        """
+
+        with self.staged_lock:
+            staged = dict(self.staged)
+            dirty = set(self.dirty)
+
+        if self.bare or (dirty and not full_scan):
+            if self.bare:
+                changes = staged
+
+            else:
+                # Get the blobs of the files written through the storage,
+                # files written with open() are hashed now.
+                changes = {}
+
+                for filename in dirty:
+                    abspath = os.path.join(self.repo.workdir, filename)
+
+                    if filename in staged:
+                        changes[filename] = staged[filename]
+
+                    elif os.path.isfile(abspath):
+                        with open(abspath, 'rb') as f:
+                            changes[filename] = self.write_blob(
+                                iter(lambda: f.read(CHUNK_SIZE), b''),
+                                os.path.getsize(abspath)
+                            )
+
+                    else:
+                        changes[filename] = None
+
+            # Apply changes to the HEAD tree, without reading the index
+            commit = self.commit_changes(user, message, changes)
+
+            with self.staged_lock:
+                # Forget committed changes, unless they were staged again
+                for path, oid in staged.items():
+                    if path in self.staged and self.staged[path] is oid:
+                        del self.staged[path]
+
+                self.dirty -= dirty
+
+            return commit
+
+        # Other processes may synchronize the index concurrently
+        with FileLock(self.index_lock_file):
+            # Apply changes committed without the index
+            self.sync_index()
+
+            # Refresh index before committing
+            index = self.repo.index
+            index.read()
+
+            # Check the status of the repository
+            status = self.repo.status()
+
+            for filename, flags in status.items():
+                # the file was deleted
+                if flags in (GIT_STATUS_INDEX_DELETED, GIT_STATUS_WT_DELETED):
+                    # remove it from the tree
+                    try:
+                        del index[filename]
+
+                    # The file was committed without the index
+                    except KeyError:
+                        pass
+
+                # or the file was modified/added
+                elif flags in (GIT_STATUS_INDEX_MODIFIED, GIT_STATUS_INDEX_NEW,
+                               GIT_STATUS_WT_MODIFIED, GIT_STATUS_WT_NEW):
+                    # add it to the tree
+                    index.add(filename)
+
+            treeid = index.write_tree()
+
+            # Now make the commit
+
+            head = self.head_sha()
+
+            commit = self.repo.create_commit(
+                None,
+                self.signature(user), self.signature(user), message,
+                treeid,
+                [head] if head else []
+            )
+
+            with self.staged_lock:
+                for path, oid in staged.items():
+                    if path in self.staged and self.staged[path] is oid:
+                        del self.staged[path]
+
+                self.dirty -= dirty
+
+            # Write changes to disk
+            index.write()
+            # and refresh index.
+            self.index.read()
+
+            # The index contains the tree of the new commit
+            self.set_index_head(self.repo[commit].hex)
+
+        if self.update_head(head, commit):
+            self.committed(head)
+
+            # Return commit object
+            return self.repo[commit]
+
+        # The branch moved concurrently, apply the changes of the index on
+        # top of it.
+        tree = self.repo[treeid]
+        changes = {}
+
+        for path in tree_changes(self.repo, self.repo[head].tree if head else None, tree):
+            entry = get_tree_entry(tree, path)
+            changes[path] = entry.oid if entry is not None else None
+
+        return self.commit_changes(user, message, changes)
+
+    def apply_changes(self, user, message, changes):
+        """
+            Commit changes on top of HEAD, and write them to the working directory.
+
+            :param user: The commit author/committer.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+            :param changes: Blob of each changed path (None for a deleted path).
+            :type changes: dict of pygit2.Oid
+            :returns: pygit2.Commit
+        """
+
+        # Write the files to the working directory before moving the branch,
+        # so the index is never synchronized with missing files.
+        if not self.bare:
+            head = self.head_sha()
+            tree = self.repo[head].tree if head else None
+
+            self.write_workdir(changes)
+
+            try:
+                commit = self.commit_changes(user, message, changes)
+
+            # Restore the files of HEAD
+            except Exception:
+                restore = {}
+
+                for name in changes:
+                    entry = get_tree_entry(tree, name)
+                    restore[name] = entry.oid if entry is not None and not is_tree_entry(entry) else None
+
+                self.write_workdir(restore)
+
+                raise
+
+        else:
+            commit = self.commit_changes(user, message, changes)
+
+        with self.staged_lock:
+            # Changes made outside of the storage are overwritten
+            for name in changes:
+                self.staged.pop(name, None)
+                self.dirty.discard(name)
+
+        return commit
+
+    def write_workdir(self, changes):
+        """
+            Write blobs to the working directory.
+
+            :param changes: Blob of each changed path (None for a deleted path).
+            :type changes: dict of pygit2.Oid
+        """
+
+        for name, oid in changes.items():
+            abspath = os.path.join(self.repo.workdir, name)
+
+            if oid is None:
+                if os.path.exists(abspath):
+                    os.remove(abspath)
+
+                continue
+
+            dirname = os.path.dirname(abspath)
+
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+            with open(abspath, 'wb') as f:
+                for chunk in self.read_blob(oid.hex):
+                    f.write(chunk)
+
+    def transaction(self, user, message):
+        """
+            Start a transaction, committing many files at once.
+
+            Usage::
+
+                with storage.transaction(user, u'Import') as tx:
+                    tx.save(u'a.txt', ContentFile('a'))
+                    tx.delete(u'b.txt')
+
+                commit = tx.commit
+
+            :param user: The commit author/committer.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+            :returns: GitTransaction
+        """
+
+        return GitTransaction(self, user, message)
+
+    def commit_changes(self, user, message, changes):
+        """
+            Commit changes on top of HEAD, without using the index.
+
+            The new tree is built from the HEAD tree, only the subtrees
+            containing changes are written.
+
+            :param user: The commit author/committer.
+            :type user: django.contrib.auth.models.User
+            :param message: The commit message.
+            :type message: unicode
+            :param changes: Blob of each changed path (None for a deleted path).
+            :type changes: dict of pygit2.Oid
+            :returns: pygit2.Commit
+        """
+
+        for attempt in range(COMMIT_RETRIES):
+            head = self.head_sha()
+
+            # Remember the commit the index is synchronized with
+            if not self.bare and self.index_head() is None:
+                self.set_index_head(head)
+
+            treeid = build_tree(self.repo, self.repo[head].tree if head else None, changes)
+
+            # Every file was deleted
+            if treeid is None:
+                treeid = self.repo.TreeBuilder().write()
+
+            commit = self.repo.create_commit(
+                None,
+                self.signature(user), self.signature(user), message,
+                treeid,
+                [head] if head else []
+            )
+
+            # If the branch moved concurrently, apply the changes again on
+            # top of it.
+            if self.update_head(head, commit):
+                self.committed(head)
+
+                return self.repo[commit]
+
+        raise GitError(u"{0}: Moved concurrently {1} times".format(BRANCH, COMMIT_RETRIES))
+
+    def update_head(self, expected, commit):
+        """
+            Move the branch to a commit, if it still points to the expected commit.
+
+            :param expected: SHA of the expected commit (or None if the branch shouldn't exist).
+            :type expected: unicode or None
+            :param commit: The new commit.
+            :type commit: pygit2.Oid
+            :returns: True if the branch was moved, False otherwise.
+        """
+
+        with FileLock(os.path.join(self.repo.path, 'gitstorage', 'branch.lock')):
+            try:
+                current = self.repo.lookup_reference(BRANCH).hex
+
+            except KeyError:
+                current = None
+
+            if current != expected:
+                return False
+
+            self.repo.create_reference(BRANCH, commit, force=True)
+
+        return True
+
+    def committed(self, previous):
+        """
+            Update caches and indexes after HEAD moved.
+
+            :param previous: SHA of the previous HEAD commit (or None for an empty repository).
+            :type previous: unicode or None
+        """
+
+        # HEAD moved, forget entries of the previous tree
+        self.tree_cache.clear()
+
+        # Index the new commit, if the history index was already built
+        if self.history is not None and self.history.exists():
+            self.history.update()
+
+        # Add the new commit to the commit graph, if it was already built
+        if self.graph is not None and self.graph.exists():
+            self.graph.update(self.head_sha())
+
+        # Index the new blobs, if the search index was already built
+        if self.search_index is not None and self.search_index.exists():
+            atree = self.repo[previous].tree if previous else None
+            btree = self.repo[self.head_sha()].tree
+            shas = []
+
+            for path in tree_changes(self.repo, atree, btree):
+                entry = get_tree_entry(btree, path)
+
+                # Removed blobs are forgotten by the next search
+                if entry is not None and not is_tree_entry(entry):
+                    shas.append(entry.hex)
+
+            self.search_index.update(shas)
+
+    def signature(self, user):
+        """
+            Get the Git signature of a user.
+
+            :param user: The commit author/committer.
+            :type user: django.contrib.auth.models.User
+            :returns: pygit2.Signature
+        """
+
+        return Signature(u'{0} {1}'.format(
+            user.first_name,
+            user.last_name).encode('utf-8'),
+            user.email.encode('utf-8')
+        )
+
+    def index_head(self):
         """
+            Get the SHA of the commit the index was last synchronized with.
 
-        super(GitFile, self).write(data.encode('utf-8'))
+            :returns: unicode (empty for an empty repository), or None if the index is synchronized with HEAD.
+        """
 
+        try:
+            with open(self.index_head_file, 'rb') as f:
+                return f.read().decode('ascii').strip()
 
-class GitStorage(Storage):
-    """ Git file storage backend. """
+        except IOError:
+            return None
 
-    def __init__(self, path):
+    def set_index_head(self, sha):
         """
-            Initialize repository.
+            Set the SHA of the commit the index is synchronized with.
 
-            :param path: Absolute path to the existing Git repository.
-            :type path: str
+            :param sha: SHA of the commit (or None for an empty repository).
+            :type sha: unicode or None
         """
 
-        super(GitStorage, self).__init__()
+        dirname = os.path.dirname(self.index_head_file)
 
-        self.repo = Repository(path)
-        self.index = self.repo.index
-        self.index.read()
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
 
-    @classmethod
-    def create_storage(cls, path):
-        """
-            Create repository, and return GitStorage object on it
+        tmpname = '{0}.{1}.tmp'.format(self.index_head_file, os.getpid())
 
-            :param path: Absolute path to the Git repository to create.
-            :type path: str
-            :returns: GitStorage
+        with open(tmpname, 'wb') as f:
+            f.write((sha or u'').encode('ascii'))
+
+        os.rename(tmpname, self.index_head_file)
+
+    def refresh_index(self):
+        """
+            Read the index, and stage the files committed without it.
         """
 
-        init_repository(path, False)
+        self.index.read()
 
-        return cls(path)
+        synced = self.index_head()
 
-    def commit(self, user, message):
-        """
-            Save previous changes in a new commit.
+        if synced is None or synced == (self.head_sha() or u''):
+            return
 
-            :param user: The commit author/committer.
-            :type user: django.contrib.auth.models.User
-            :param message: The commit message.
-            :type message: unicode
-            :returns: pygit2.Commit
-        """
+        # Only one process writes the index
+        with FileLock(self.index_lock_file):
+            self.sync_index()
 
-        # Refresh index before committing
-        index = self.repo.index
-        index.read()
+    def sync_index(self):
+        """
+            Stage the files committed without the index, the index lock must be held.
+        """
 
-        # Check the status of the repository
-        status = self.repo.status()
+        self.index.read()
 
-        for filename, flags in status.items():
-            # the file was deleted
-            if flags in (GIT_STATUS_INDEX_DELETED, GIT_STATUS_WT_DELETED):
-                # remove it from the tree
-                del index[filename]
+        synced = self.index_head()
+        head = self.head_sha()
 
-            # or the file was modified/added
-            elif flags in (GIT_STATUS_INDEX_MODIFIED, GIT_STATUS_INDEX_NEW,
-                           GIT_STATUS_WT_MODIFIED, GIT_STATUS_WT_NEW):
-                # add it to the tree
-                index.add(filename)
+        # Synchronized while waiting for the lock
+        if synced is None or synced == (head or u''):
+            return
 
-        treeid = index.write_tree()
+        # Stage the files changed since the last synchronization
+        atree = self.repo[synced].tree if synced else None
+        btree = self.repo[head].tree if head else None
 
-        # Now make the commit
+        for filename in tree_changes(self.repo, atree, btree):
+            entry = get_tree_entry(btree, filename)
 
-        author = Signature(u'{0} {1}'.format(
-            user.first_name,
-            user.last_name).encode('utf-8'),
-            user.email.encode('utf-8')
-        )
-        committer = author
+            if entry is None or is_tree_entry(entry):
+                try:
+                    del self.index[filename]
 
-        try:
-            parents = [self.repo.head.oid]
+                # The file isn't in the index
+                except KeyError:
+                    pass
 
-        except GitError:
-            parents = []
+                continue
 
-        commit = self.repo.create_commit(
-            'refs/heads/master',
-            author, committer, message,
-            treeid,
-            parents
-        )
+            # Stage the committed blob, a committed file is missing from the
+            # working directory only if its writer was interrupted.
+            if not os.path.exists(os.path.join(self.repo.workdir, filename)):
+                self.write_workdir({filename: entry.oid})
 
-        # Write changes to disk
-        index.write()
-        # and refresh index.
-        self.index.read()
+            self.index.add(filename)
 
-        # Return commit object
-        return self.repo[commit]
+        self.index.write()
+        self.set_index_head(head)
 
-    def log(self, name=None, limit=10):
+    def log(self, name=None, limit=10, after=None):
         """
             Get history of the repository, or of a file if name is not None.
 
@@ -138,15 +2528,66 @@ class GitStorage(Storage):
             :type name: unicode or None
             :param limit: Maximal number of commits to get (default: 10), use a negative number to get all.
             :type limit: int
+            :param after: Cursor returned by ``log_page()``, to get the following commits.
+            :type after: str or None
             :returns: list of pygit2.Commit
         """
 
+        return self.log_page(name=name, limit=limit, after=after)[0]
+
+    def log_page(self, name=None, limit=10, after=None):
+        """
+            Get one page of the history of the repository, or of a file if name is not None.
+
+            The cursor holds the state of the history walk, so getting the
+            next page costs the same as getting the first one.
+
+            :param name: File name within the repository.
+            :type name: unicode or None
+            :param limit: Maximal number of commits to get (default: 10), use a negative number to get all.
+            :type limit: int
+            :param after: Cursor returned with the previous page (or None for the first page).
+            :type after: str or None
+            :returns: a 2-tuple; the first item being a list of pygit2.Commit, the second item being the cursor of the next page (or None).
+            :raises: ValueError
+        """
+
         commits = []
 
+        state = self.decode_cursor(after, name) if after is not None else {}
+
+        if self.head_sha() is None or limit == 0:
+            return (commits, None)
+
+        if name and self.history is not None:
+            # Get commits from the history index
+            shas = self.history.commits(name)
+            start = 0
+
+            # Continue after the last commit of the previous page
+            if 'last' in state:
+                try:
+                    start = shas.index(state['last']) + 1
+
+                except ValueError:
+                    raise ValueError(u"Invalid cursor")
+
+            end = len(shas) if limit < 0 else start + limit
+
+            for sha in shas[start:end]:
+                commits.append(self.repo[sha])
+
+            if end >= len(shas):
+                return (commits, None)
+
+            return (commits, self.encode_cursor(name, last=commits[-1].hex))
+
+        walker = HistoryWalker(self, state.get('frontier'))
+
         if not name:
-            # Look for `limit` commits
-            for commit in self.repo.walk(self.repo.head.oid, GIT_SORT_TIME):
-                commits.append(commit)
+            # Look for `limit` commits, only those are loaded
+            for sha in walker:
+                commits.append(self.repo[sha])
 
                 limit = limit - 1
 
@@ -155,51 +2596,111 @@ class GitStorage(Storage):
 
         else:
             # For each commits
-            for commit in self.repo.walk(self.repo.head.oid, GIT_SORT_TIME):
-                # Check the presence of the file in the tree
+            for sha in walker:
+                commit = self.repo[sha]
 
-                if commit.parents:
-                    # If the commit has parents, check if the file is present
-                    # in the diff
+                # Compare the entries along the path with the parent's tree,
+                # for a root commit, simply check the presence of the file.
+                parent = commit.parents[0].tree if commit.parents else None
 
-                    diff = commit.tree.diff(commit.parents[0].tree)
+                if path_changed(self.repo, commit.tree, parent, name):
+                    commits.append(commit)
 
-                    for patch in diff:
-                        # If the filename is the patch's filename...
-                        if name.encode('utf-8') == patch.new_file_path:
-                            # ... then we can add the commit to the list
-                            # and leave the loop
+                    limit = limit - 1
 
-                            commits.append(commit)
+                # If the limit is reached, leave the loop
+                if limit == 0:
+                    break
 
-                            limit = limit - 1
-                            break
+        frontier = walker.frontier()
 
-                else:
-                    # But if the commit has no parents (root commit)
-                    # Simply check in its tree
+        if not frontier:
+            return (commits, None)
 
-                    try:
-                        commit.tree[name]
+        return (commits, self.encode_cursor(name, frontier=frontier))
 
-                        # no error raised, it means the entry exists, so add the
-                        # commit to the list
-                        commits.append(commit)
+    def encode_cursor(self, name, **state):
+        """
+            Get an opaque cursor holding the state of a history walk.
 
-                        limit = limit - 1
+            :param name: File name within the repository.
+            :type name: unicode or None
+            :returns: str
+        """
 
-                    # If the file is not in the tree, then it raises a KeyError,
-                    # so, just ignore it.
-                    except KeyError:
-                        pass
+        state['name'] = name or None
 
-                # If the limit is reached, leave the loop
-                if limit == 0:
-                    break
+        return base64.urlsafe_b64encode(json.dumps(state).encode('utf-8'))
+
+    def decode_cursor(self, cursor, name):
+        """
+            Get the state of a history walk from a cursor.
+
+            :param cursor: Cursor returned by ``encode_cursor()``.
+            :type cursor: str
+            :param name: File name within the repository.
+            :type name: unicode or None
+            :returns: dict
+            :raises: ValueError
+        """
+
+        try:
+            state = json.loads(base64.urlsafe_b64decode(to_bytes(cursor)).decode('utf-8'))
+
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise ValueError(u"Invalid cursor")
+
+        if not isinstance(state, dict) or state.get('name') != (name or None):
+            raise ValueError(u"Cursor doesn't match {0}".format(name))
+
+        return state
+
+    def commit_parents(self, sha):
+        """
+            Get the parents of a commit.
+
+            :param sha: SHA of the commit.
+            :type sha: unicode
+            :returns: tuple of unicode
+        """
+
+        if self.graph is not None and self.graph.commits is not None and sha in self.graph.commits:
+            return self.graph.commits[sha][2]
+
+        return tuple(parent.hex for parent in self.repo[sha].parents)
+
+    def walk_history(self, starts=None):
+        """
+            Walk history from the newest to the oldest commit.
+
+            With the commit graph, commits are walked without being loaded.
+
+            :param starts: SHA of the commits to start from (default: None, to start from HEAD).
+            :type starts: list of unicode or None
+            :returns: generator of unicode
+        """
 
-        return commits
+        if starts is None:
+            head = self.head_sha()
+            starts = [head] if head else []
 
-    def diffs(self, name=None, limit=10):
+        if not starts:
+            return
+
+        if self.graph is not None:
+            for sha in self.graph.walk(starts):
+                yield sha
+
+        else:
+            walker = self.repo.walk(starts[0], GIT_SORT_TIME)
+
+            for sha in starts[1:]:
+                walker.push(sha)
+
+            for commit in walker:
+                yield commit.hex
+
+    def diffs(self, name=None, limit=10, after=None):
         """
             Get diffs between commits.
 
@@ -214,18 +2715,21 @@ class GitStorage(Storage):
                         "parent_sha": unicode(<parent commit SHA>), # optional
                     },
                     # ...
-                ]}
+                ],
+                "next": str(<cursor of the next page>)} # or None
 
             :param name: File name within the repository.
             :type name: unicode or None
             :param limit: Maximal number of diffs to get (default: 10), use a negative number to get all.
             :type limit: int
+            :param after: Cursor of the previous page (or None for the first page).
+            :type after: str or None
             :returns: dict
         """
 
-        commits = self.log(name=name, limit=limit)
+        commits, cursor = self.log_page(name=name, limit=limit, after=after)
 
-        diffs = {'diffs': []}
+        diffs = {'diffs': [], 'next': cursor}
 
         # For each commit
         for commit in commits:
@@ -262,65 +2766,422 @@ class GitStorage(Storage):
         c1 = self.repo[asha]
         c2 = self.repo[bsha]
 
-        d = c1.tree.diff(c2.tree)
+        # Commits are immutable, so is their diff
+        key = 'gitstorage.diff.{0}'.format(hashlib.sha1(
+            u'{0}:{1}:{2}'.format(c1.hex, c2.hex, name or u'').encode('utf-8')
+        ).hexdigest())
+
+        if self.diff_cache is not None:
+            diff = self.diff_cache.get(key)
+
+            if diff is not None:
+                return diff
+
+        diff = self.render_diff(c1, c2, name)
+
+        if self.diff_cache is not None:
+            self.diff_cache.set(key, diff)
+
+        return diff
+
+    def render_diff(self, c1, c2, name=None):
+        """
+            Compute diff between two commits.
+
+            :param c1: Commit A.
+            :type c1: pygit2.Commit
+            :param c2: Commit B.
+            :type c2: pygit2.Commit
+            :param name: File name within the repository.
+            :type name: unicode or None
+            :returns: unicode
+        """
 
         if name:
-            diff = u''
+            aentry = get_tree_entry(c1.tree, name)
+            bentry = get_tree_entry(c2.tree, name)
+
+            # The file is the same in both commits
+            if aentry is None and bentry is None:
+                return u''
+
+            elif aentry is not None and bentry is not None and aentry.hex == bentry.hex:
+                return u''
+
+            # Only diff the directories containing the file
+            atree, btree, prefix = self.diff_trees(c1, c2, name)
+
+            parts = []
 
             # For each patch in the diff
-            for patch in d:
+            for patch in atree.diff(btree):
                 # Check if the patch is our file
-                if name.encode('utf-8') == patch.new_file_path:
+                if u'{0}{1}'.format(prefix, to_unicode(patch.new_file_path)) == name:
                     # Format the patch
                     for hunk in patch.hunks:
-                        p = u'\n'.join(hunk.lines)
+                        parts.extend(format_diff_line(line) for line in hunk.lines)
 
-                        # And add the diff to the final diff
-                        diff = u'{0}{1}'.format(diff, p)
-
-            return diff
+            return u''.join(parts)
 
         # For a global diff, just return the full patch
         else:
-            return d.patch
+            return c1.tree.diff(c2.tree).patch
 
-    def search(self, pattern, exclude=None):
+    def iter_diff(self, asha, bsha, name=None, max_bytes=None, max_files=None):
         """
-            Search pattern in GIT repository.
+            Iterate over the diff between two commits, hunk by hunk.
 
+            Patches are generated one file at a time, so the whole diff is never
+            held in memory. The result can be given to a ``StreamingHttpResponse``.
+
+            :param asha: SHA of commit A.
+            :type asha: unicode
+            :param bsha: SHA of commit B.
+            :type bsha: unicode
+            :param name: File name within the repository.
+            :type name: unicode or None
+            :param max_bytes: Maximal size of the output in bytes (or None for no limit).
+            :type max_bytes: int or None
+            :param max_files: Maximal number of files in the output (or None for no limit).
+            :type max_files: int or None
+            :returns: generator of unicode
+        """
+
+        c1 = self.repo[asha]
+        c2 = self.repo[bsha]
+
+        if name:
+            # Only diff the directories containing the file
+            atree, btree, prefix = self.diff_trees(c1, c2, name)
+
+        else:
+            atree, btree, prefix = c1.tree, c2.tree, u''
+
+        patches = (
+            patch for patch in atree.diff(btree)
+            if not name or u'{0}{1}'.format(prefix, to_unicode(patch.new_file_path)) == name
+        )
+
+        size = 0
+
+        # For each patch in the diff
+        for count, patch in enumerate(patches):
+            if max_files is not None and count >= max_files:
+                break
+
+            for chunk in self.iter_patch(patch, atree, btree, prefix):
+                size += len(chunk.encode('utf-8'))
+
+                # Stop before going over the limit
+                if max_bytes is not None and size > max_bytes:
+                    return
+
+                yield chunk
+
+    def iter_patch(self, patch, atree, btree, prefix=u''):
+        """
+            Iterate over the header and the hunks of a patch, formatted as by ``git diff``.
+
+            :param patch: Patch of one file.
+            :type patch: pygit2.Patch
+            :param atree: Tree of commit A containing the file.
+            :type atree: pygit2.Tree
+            :param btree: Tree of commit B containing the file.
+            :type btree: pygit2.Tree
+            :param prefix: Path of the diffed trees within the repository.
+            :type prefix: unicode
+            :returns: generator of unicode
+        """
+
+        aentry = get_tree_entry(atree, to_unicode(patch.old_file_path))
+        bentry = get_tree_entry(btree, to_unicode(patch.new_file_path))
+
+        # Added (or deleted) files have no mode and a null SHA on one side
+        amode = aentry.filemode if aentry is not None else 0
+        bmode = bentry.filemode if bentry is not None else 0
+        asha = aentry.hex if aentry is not None else u'0' * 40
+        bsha = bentry.hex if bentry is not None else u'0' * 40
+
+        old_path = u'{0}{1}'.format(prefix, to_unicode(patch.old_file_path))
+        new_path = u'{0}{1}'.format(prefix, to_unicode(patch.new_file_path))
+
+        header = [u'diff --git a/{0} b/{1}\n'.format(old_path, new_path)]
+
+        if amode == bmode:
+            header.append(u'index {0}..{1} {2:o}\n'.format(asha[:7], bsha[:7], amode))
+
+        else:
+            if not amode:
+                header.append(u'new file mode {0:o}\n'.format(bmode))
+
+            elif not bmode:
+                header.append(u'deleted file mode {0:o}\n'.format(amode))
+
+            else:
+                header.append(u'old mode {0:o}\n'.format(amode))
+                header.append(u'new mode {0:o}\n'.format(bmode))
+
+            header.append(u'index {0}..{1}\n'.format(asha[:7], bsha[:7]))
+
+        old_path = u'a/{0}'.format(old_path) if aentry is not None else u'/dev/null'
+        new_path = u'b/{0}'.format(new_path) if bentry is not None else u'/dev/null'
+
+        # Binary files have no hunks
+        if not patch.hunks and any(
+            b'\0' in self.repo[entry.oid].data[:BINARY_CHECK_SIZE]
+            for entry in (aentry, bentry) if entry is not None
+        ):
+            header.append(u'Binary files {0} and {1} differ\n'.format(old_path, new_path))
+
+        else:
+            header.append(u'--- {0}\n'.format(old_path))
+            header.append(u'+++ {0}\n'.format(new_path))
+
+        yield u''.join(header)
+
+        for hunk in patch.hunks:
+            lines = [self.hunk_header(hunk)]
+            lines.extend(format_diff_line(line) for line in hunk.lines)
+
+            yield u''.join(lines)
+
+    def hunk_header(self, hunk):
+        """
+            Get the header of a diff hunk.
+
+            :param hunk: The hunk.
+            :type hunk: pygit2.Hunk
+            :returns: unicode
+        """
+
+        # The header of libgit2 also contains the enclosing function
+        header = getattr(hunk, 'header', None)
+
+        if header:
+            return to_unicode(header)
+
+        # Ranges of a single line have no length
+        old = u'{0}'.format(hunk.old_start) if hunk.old_lines == 1 else \
+            u'{0},{1}'.format(hunk.old_start, hunk.old_lines)
+        new = u'{0}'.format(hunk.new_start) if hunk.new_lines == 1 else \
+            u'{0},{1}'.format(hunk.new_start, hunk.new_lines)
+
+        return u'@@ -{0} +{1} @@\n'.format(old, new)
+
+    def diff_trees(self, c1, c2, name):
+        """
+            Get the deepest directories containing a file in both commits.
+
+            Diffing these directories compares the entries around the file
+            only, without writing any object.
+
+            :param c1: Commit A.
+            :type c1: pygit2.Commit
+            :param c2: Commit B.
+            :type c2: pygit2.Commit
+            :param name: File name within the repository.
+            :type name: unicode
+            :returns: tuple containing both trees and their path (empty for the root, ends with a slash otherwise).
+        """
+
+        dirname = name.rpartition(u'/')[0]
+
+        while dirname:
+            aentry = get_tree_entry(c1.tree, dirname)
+            bentry = get_tree_entry(c2.tree, dirname)
+
+            if is_tree_entry(aentry) and is_tree_entry(bentry):
+                return self.repo[aentry.oid], self.repo[bentry.oid], u'{0}/'.format(dirname)
+
+            # The directory was added or removed, diff its parent
+            dirname = dirname.rpartition(u'/')[0]
+
+        return c1.tree, c2.tree, u''
+
+    def search_blob(self, sha, pattern, max_lines=None):
+        """
+            Search pattern in a blob.
+
+            :param sha: SHA of the blob.
+            :type sha: unicode
             :param pattern: Pattern to search.
-            :type pattern: unicode
+            :type pattern: unicode or SearchQuery
+            :param max_lines: Maximal number of matched lines to get (default: None, to get all).
+            :type max_lines: int or None
+            :returns: list of matched lines.
+        """
+
+        if not isinstance(pattern, SearchQuery):
+            pattern = SearchQuery(pattern)
+
+        key = (sha, pattern.key, max_lines)
+
+        if self.search_cache is not None:
+            lines = self.search_cache.get(key)
+
+            if lines is not None:
+                return list(lines)
+
+        # Get the associated blob, and its matched lines
+        lines = pattern.lines(self.repo[sha].data, max_lines)
+
+        if self.search_cache is not None:
+            self.search_cache.set(key, tuple(lines))
+
+        return lines
+
+    def iter_search(self, pattern, exclude=None, limit=None, max_lines=None, workers=None, regex=False):
+        """
+            Search pattern in GIT repository, and yield results as they are found.
+
+            :param pattern: Pattern, or list of patterns, to search.
+            :type pattern: unicode or list of unicode
+            :param exclude: Exclude some files from the search results
+            :type exclude: regex
+            :param limit: Maximal number of files to yield (default: None, to yield all).
+            :type limit: int or None
+            :param max_lines: Maximal number of matched lines per file (default: None, to get all).
+            :type max_lines: int or None
+            :param workers: Number of threads reading blobs (default: None, to search in the current thread).
+            :type workers: int or None
+            :param regex: Patterns are regular expressions (default: False).
+            :type regex: bool
+            :returns: generator of tuple containing the filename and the list of matched lines.
+        """
+
+        if limit is not None and limit <= 0:
+            return
+
+        # Compile the query and the exclude regex once
+        query = SearchQuery(pattern, regex=regex)
+        exclude = re.compile(exclude) if exclude else None
+
+        entries = list(self.walk())
+
+        # Get the blobs which may contain the pattern
+        candidates = None
+
+        if self.search_index is not None and not regex:
+            shas = set(ientry.hex for ientry in entries)
+
+            self.search_index.update(shas)
+            self.search_index.prune(shas)
+
+            candidates = query.candidates(self.search_index)
+
+        # Select files to search
+        selected = []
+
+        for ientry in entries:
+            path = ientry.path.decode('utf-8')
+
+            # If the filename match the exclude_file regex, then ignore it
+            if exclude and exclude.match(path):
+                continue
+
+            # If the blob can't contain the pattern, then ignore it
+            if candidates is not None and ientry.hex not in candidates:
+                continue
+
+            selected.append((path, ientry.hex))
+
+        def search_entry(entry):
+            return self.search_blob(entry[1], query, max_lines)
+
+        # Search in each blob, pygit2 releases the GIL while reading objects,
+        # so blobs can be read by a pool of threads.
+        pool = None
+
+        if workers and workers > 1 and len(selected) > 1:
+            pool = ThreadPool(workers)
+
+            # imap() returns results in the order of the files, as soon as
+            # they are available.
+            results = pool.imap(search_entry, selected)
+
+        else:
+            results = (search_entry(entry) for entry in selected)
+
+        try:
+            for i, lines in enumerate(results):
+                # If the entry has no matched lines, then ignore
+                if not lines:
+                    continue
+
+                yield (selected[i][0], lines)
+
+                if limit is not None:
+                    limit = limit - 1
+
+                    if limit == 0:
+                        break
+
+        finally:
+            # Stop pending searches when leaving early
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def search(self, pattern, exclude=None, workers=None, regex=False):
+        """
+            Search pattern in GIT repository.
+
+            :param pattern: Pattern, or list of patterns, to search.
+            :type pattern: unicode or list of unicode
             :param exclude: Exclude some files from the search results
             :type exclude: regex
+            :param workers: Number of threads reading blobs (default: None, to search in the current thread).
+            :type workers: int or None
+            :param regex: Patterns are regular expressions (default: False).
+            :type regex: bool
             :returns: list of tuple containing the filename and the list of matched lines.
         """
 
-        entries = []
+        return list(self.iter_search(pattern, exclude=exclude, workers=workers, regex=regex))
 
-        self.index.read()
+    def head_sha(self):
+        """
+            Get the SHA of the HEAD commit.
+
+            :returns: unicode, or None if the head is orphaned.
+        """
+
+        if self.repo.head_is_orphaned:
+            return None
+
+        return self.repo.head.hex
+
+    def tree_item(self, name):
+        """
+            Get type, SHA, mode and size of a path within the HEAD tree.
+
+            Items are cached until HEAD moves, the size of a blob is only
+            known once ``size()`` was called.
+
+            :param name: File name within the repository.
+            :type name: unicode
+            :returns: TreeItem, or None if the path doesn't exist.
+        """
+
+        head = self.head_sha()
 
-        # For each files in the index
-        for ientry in self.index:
-            # If the filename match the exclude_file regex, then ignore it
-            if exclude and re.match(exclude, ientry.path.decode('utf-8')):
-                continue
+        # There is nothing in the repository
+        if head is None:
+            return None
 
-            # Get the associated blob
-            blob = self.repo[ientry.oid]
+        key = (head, name)
+        item = self.tree_cache.get(key, False)
 
-            # Create entry
-            entry = (ientry.path.decode('utf-8'), [])
+        if item is not False:
+            return item
 
-            # Add matched lines to the entry
-            for line in blob.data.decode('utf-8').splitlines():
-                if pattern in line:
-                    entry[1].append(line)
+        # Try getting the path via the tree, if it raises a KeyError, then
+        # the path doesn't exist
+        item = to_tree_item(get_tree_entry(self.repo[head].tree, name))
 
-            # If the entry has no matched lines, then ignore
-            if entry[1]:
-                entries.append(entry)
+        self.tree_cache.set(key, item)
 
-        return entries
+        return item
 
     def is_dir(self, name):
         """
@@ -331,23 +3192,9 @@ class GitStorage(Storage):
             :returns: True, False
         """
 
-        # Check if the path exists, if not returns default value.
-        if not self.exists(name):
-            return False
-
-        # Get the TreeEntry associated to name
-        tentry = self.repo.head.tree[name]
-
-        # Convert it to its pygit2 representation
-        obj = tentry.to_object()
-
-        # If it's a Tree, then we can return True
-        if isinstance(obj, Tree):
-            return True
+        item = self.tree_item(name)
 
-        # The instance is a Blob, so it's a file, return False
-        else:
-            return False
+        return item is not None and item.type == 'tree'
 
     def mimetype(self, name):
         """
@@ -358,35 +3205,152 @@ class GitStorage(Storage):
             :returns: str
         """
 
-        # If the file is a directory
-        if self.is_dir(name):
-            return 'inode/directory'
+        item = self.tree_item(name)
 
-        # Or doesn't exist
-        elif not self.exists(name):
+        # If the file doesn't exist
+        if item is None:
             return 'unknown'
 
+        # Or is a directory
+        elif item.type == 'tree':
+            return 'inode/directory'
+
         # The file exists, check its mimetype
         else:
-            import urllib
-            import mimetypes
+            return guess_mimetype(name)
+
+    def stat_many(self, paths):
+        """
+            Get metadata of many paths at once.
+
+            The HEAD tree is resolved once, and each directory is loaded once
+            for all the paths it contains.
+
+            :param paths: File names within the repository.
+            :type paths: list of unicode
+            :returns: dict of FileStat (or None if the path doesn't exist), keyed by path.
+        """
+
+        stats = {}
+
+        head = self.head_sha()
+
+        if head is None:
+            return dict((name, None) for name in paths)
+
+        # Trees of the directories containing the paths
+        trees = {u'': self.repo[head].tree}
+
+        for name in paths:
+            item = self.tree_cache.get((head, name), False)
+
+            if item is False:
+                dirname, _, basename = name.rpartition(u'/')
+
+                if dirname not in trees:
+                    entry = get_tree_entry(trees[u''], dirname)
+                    trees[dirname] = self.repo[entry.oid] if is_tree_entry(entry) else None
+
+                item = to_tree_item(get_tree_entry(trees[dirname], basename))
+
+            if item is None:
+                stats[name] = None
+                self.tree_cache.set((head, name), None)
+                continue
+
+            if item.type == 'blob' and item.size is None:
+                item = item._replace(size=self.repo[item.sha].size)
+
+            self.tree_cache.set((head, name), item)
+
+            # Get the last modified time from the working directory
+            try:
+                abspath = os.path.join(self.repo.workdir, name)
+                mtime = datetime.datetime.fromtimestamp(os.stat(abspath).st_mtime)
+
+            except (OSError, TypeError, AttributeError):
+                mtime = None
 
-            url = urllib.pathname2url(name.encode('utf-8'))
+            stats[name] = FileStat(
+                item.type,
+                item.size,
+                item.sha,
+                item.mode,
+                mtime,
+                'inode/directory' if item.type == 'tree' else guess_mimetype(name)
+            )
 
-            return mimetypes.guess_type(url)[0] or 'unknown'
+        return stats
 
     def walk(self):
         """
             Walk through the repository.
+
+            Yield the entries of the index, or of the HEAD tree in a bare
+            repository.
         """
 
-        self.index.read()
+        if not self.bare:
+            self.refresh_index()
+
+            for entry in self.index:
+                yield entry
+
+        else:
+            for entry in self.walk_tree():
+                yield entry
+
+    def walk_tree(self):
+        """
+            Walk through the HEAD tree.
+
+            Yield the files of the HEAD tree, as IndexItem objects.
+        """
+
+        head = self.head_sha()
+
+        if head is None:
+            return
+
+        stack = [(u'', self.repo[head].tree)]
+
+        while stack:
+            prefix, tree = stack.pop()
+            subtrees = []
+
+            for entry in tree:
+                path = u'{0}{1}'.format(prefix, to_unicode(entry.name))
+
+                if is_tree_entry(entry):
+                    subtrees.append((u'{0}/'.format(path), self.repo[entry.oid]))
+
+                else:
+                    yield IndexItem(path.encode('utf-8'), entry.hex)
 
-        for entry in self.index:
-            yield entry
+            # Walk subtrees in order
+            stack.extend(reversed(subtrees))
 
     # Storage API
 
+    def commit_time(self, name, oldest=False):
+        """
+            Get the time of the newest (or oldest) commit touching a file.
+
+            :param name: File name within the repository.
+            :type name: unicode
+            :param oldest: Get the time of the oldest commit (default: False).
+            :type oldest: bool
+            :returns: datetime
+            :raises: IOError
+        """
+
+        commits = self.log(name=name, limit=-1 if oldest else 1)
+
+        if not commits:
+            raise IOError(u"{0}: No commit found".format(name))
+
+        return datetime.datetime.fromtimestamp(commits[-1].commit_time)
+
     def accessed_time(self, name):
         """
             Get last accessed time of a file.
@@ -400,6 +3364,10 @@ class GitStorage(Storage):
         if not self.exists(name):
             raise IOError(u"{0}: Not found in repository".format(name))
 
+        # Without working directory, use the newest commit of the file
+        if self.bare:
+            return self.commit_time(name, oldest=False)
+
         abspath = os.path.join(self.repo.workdir, name)
         stats = os.stat(abspath)
 
@@ -418,6 +3386,10 @@ class GitStorage(Storage):
         if not self.exists(name):
             raise IOError(u"{0}: Not found in repository".format(name))
 
+        # Without working directory, use the oldest commit of the file
+        if self.bare:
+            return self.commit_time(name, oldest=True)
+
         abspath = os.path.join(self.repo.workdir, name)
         stats = os.stat(abspath)
 
@@ -436,6 +3408,10 @@ class GitStorage(Storage):
         if not self.exists(name):
             raise IOError(u"{0}: Not found in repository".format(name))
 
+        # Without working directory, use the newest commit of the file
+        if self.bare:
+            return self.commit_time(name, oldest=False)
+
         abspath = os.path.join(self.repo.workdir, name)
         stats = os.stat(abspath)
 
@@ -451,13 +3427,16 @@ class GitStorage(Storage):
             :raises: IOError
         """
 
-        if not self.exists(name):
+        item = self.tree_item(name)
+
+        if item is None:
             raise IOError(u"{0}: Not found in repository".format(name))
 
-        e = self.index[name]
-        blob = self.repo[e.oid]
+        if item.size is None:
+            item = item._replace(size=self.repo[item.sha].size)
+            self.tree_cache.set((self.head_sha(), name), item)
 
-        return blob.size
+        return item.size
 
     def exists(self, path):
         """
@@ -468,30 +3447,244 @@ class GitStorage(Storage):
             :returns: True if the file exists, False if the name is available for a new file.
         """
 
-        # If the head is orphaned (does not point to any commit), returns False
-        # because there is nothing in the repository.
-        if self.repo.head_is_orphaned:
-            return False
+        return self.tree_item(path) is not None
 
-        # Try getting the path via the tree
-        try:
-            entry = self.repo.head.tree[path]
+    def listdir_tree(self, path=None):
+        """
+            Lists the contents of the specified path within the HEAD tree.
 
-            return True
+            Results are cached by tree SHA, so unchanged directories are
+            listed once.
 
-        # If it raises a KeyError, then the path doesn't exist
-        except KeyError:
-            return False
+            :param path: Path of the directory to list (or None to list the root).
+            :type path: unicode or None
+            :returns: a 2-tuple of lists; the first item being directories, the second item being files.
+            :raises: OSError
+        """
+
+        head = self.head_sha()
+
+        # Nothing was committed yet
+        if head is None:
+            return ([], [])
+
+        tree = self.repo[head].tree
+
+        if path:
+            entry = get_tree_entry(tree, path.strip(u'/'))
+
+            if not is_tree_entry(entry):
+                raise OSError(u"{0}: Not a directory in repository".format(path))
+
+            sha = entry.hex
+
+        else:
+            sha = tree.hex
+
+        listing = self.listdir_cache.get(sha)
+
+        if listing is None:
+            dirs = []
+            files = []
+
+            for entry in self.repo[sha]:
+                if is_tree_entry(entry):
+                    dirs.append(to_unicode(entry.name))
+
+                else:
+                    files.append(to_unicode(entry.name))
+
+            listing = (tuple(dirs), tuple(files))
+            self.listdir_cache.set(sha, listing)
+
+        return (list(listing[0]), list(listing[1]))
+
+    def listdir_index(self, path=None):
+        """
+            Lists the contents of the specified path within the index.
+
+            :param path: Path of the directory to list (or None to list the root).
+            :type path: unicode or None
+            :returns: a 2-tuple of lists; the first item being directories, the second item being files.
+        """
+
+        prefix = u'{0}/'.format(path.strip(u'/')) if path else u''
+
+        dirs = []
+        files = []
+
+        for ientry in self.walk():
+            name = ientry.path.decode('utf-8')
+
+            if not name.startswith(prefix):
+                continue
+
+            name = name[len(prefix):]
+
+            # Entries are sorted, so a directory follows its previous entry
+            if u'/' in name:
+                dirname = name.split(u'/', 1)[0]
+
+                if not dirs or dirs[-1] != dirname:
+                    dirs.append(dirname)
+
+            else:
+                files.append(name)
+
+        return (dirs, files)
+
+    def last_commit_times(self, path, names):
+        """
+            Get the time of the last commit touching entries of a directory.
+
+            :param path: Path of the directory (or None for the root).
+            :type path: unicode or None
+            :param names: Names of the entries within the directory.
+            :type names: list of unicode
+            :returns: dict of int (timestamp, or 0 if unknown), keyed by name.
+        """
+
+        prefix = u'{0}/'.format(path.strip(u'/')) if path else u''
+        times = dict((name, 0) for name in names)
+
+        if self.history is not None:
+            self.history.update()
+
+            commit_times = {}
+
+            # Find the newest commit of each file below the directory
+            for name, shas in self.history.paths.items():
+                if not shas or not name.startswith(prefix):
+                    continue
+
+                child = name[len(prefix):].split(u'/', 1)[0]
+
+                if child not in times:
+                    continue
+
+                if shas[-1] not in commit_times:
+                    commit_times[shas[-1]] = self.repo[shas[-1]].commit_time
+
+                times[child] = max(times[child], commit_times[shas[-1]])
+
+        else:
+            for name in names:
+                commits = self.log(name=u'{0}{1}'.format(prefix, name), limit=1)
 
-    def listdir(self, path=None):
+                if commits:
+                    times[name] = commits[0].commit_time
+
+        return times
+
+    def listdir_page(self, path=None, limit=100, cursor=None, order='name'):
+        """
+            Lists one page of the contents of the specified path within the HEAD tree.
+
+            Entries ordered by name are read directly from the tree, in Git
+            order (a directory ``name`` is sorted as ``name/``). Entries
+            ordered by time (last commit touching the entry, newest first)
+            are sorted once per tree and HEAD commit.
+
+            :param path: Path of the directory to list (or None to list the root).
+            :type path: unicode or None
+            :param limit: Maximal number of entries in the page (default: 100).
+            :type limit: int
+            :param cursor: Cursor returned with the previous page (or None for the first page).
+            :type cursor: unicode or None
+            :param order: ``'name'`` (default) or ``'time'``.
+            :type order: str
+            :returns: a 2-tuple; the first item being a list of ``(name, type)`` tuples, the second item being the cursor of the next page (or None).
+            :raises: OSError, ValueError
+        """
+
+        head = self.head_sha()
+
+        # Nothing was committed yet
+        if head is None:
+            return ([], None)
+
+        tree = self.repo[head].tree
+
+        if path:
+            entry = get_tree_entry(tree, path.strip(u'/'))
+
+            if not is_tree_entry(entry):
+                raise OSError(u"{0}: Not a directory in repository".format(path))
+
+            tree = self.repo[entry.oid]
+
+        def sort_key(entry):
+            name = to_bytes(entry.name)
+
+            return name + b'/' if is_tree_entry(entry) else name
+
+        def describe(entry):
+            return (to_unicode(entry.name), 'tree' if is_tree_entry(entry) else 'blob')
+
+        if order == 'name':
+            # Look for the first entry after the cursor, without reading the
+            # whole tree.
+            start, end = 0, len(tree)
+
+            if cursor is not None:
+                key = to_bytes(cursor)
+
+                while start < end:
+                    middle = (start + end) // 2
+
+                    if sort_key(tree[middle]) <= key:
+                        start = middle + 1
+
+                    else:
+                        end = middle
+
+            end = min(start + limit, len(tree))
+            entries = [tree[i] for i in range(start, end)]
+
+            next_cursor = to_unicode(sort_key(entries[-1])) if entries and end < len(tree) else None
+
+            return ([describe(e) for e in entries], next_cursor)
+
+        elif order == 'time':
+            cache_key = ('time', head, tree.hex)
+            listing = self.listdir_cache.get(cache_key)
+
+            if listing is None:
+                entries = [describe(e) for e in tree]
+                times = self.last_commit_times(path, [name for name, _ in entries])
+
+                listing = tuple(sorted(entries, key=lambda e: (-times[e[0]], e[0])))
+                self.listdir_cache.set(cache_key, listing)
+
+            start = int(cursor) if cursor is not None else 0
+            end = start + limit
+
+            next_cursor = u'{0}'.format(end) if end < len(listing) else None
+
+            return (list(listing[start:end]), next_cursor)
+
+        else:
+            raise ValueError(u"{0}: Unknown order".format(order))
+
+    def listdir(self, path=None, source='workdir'):
         """
             Lists the contents of the specified path.
 
             :param path: Path of the directory to list (or None to list the root).
             :type path: unicode or None
+            :param source: Where to list the directory: ``'workdir'`` (default), ``'tree'`` for the HEAD tree or ``'index'``.
+            :type source: str
             :returns: a 2-tuple of lists; the first item being directories, the second item being files.
         """
 
+        # The HEAD tree and the index are listed without any filesystem access,
+        # and a bare repository has no working directory to list.
+        if source == 'tree' or self.bare:
+            return self.listdir_tree(path)
+
+        elif source == 'index':
+            return self.listdir_index(path)
+
         abspath = os.path.join(self.repo.workdir, path) if path else self.repo.workdir
 
         dirs = []
@@ -520,14 +3713,56 @@ class GitStorage(Storage):
             :returns: GitFile
         """
 
+        if self.bare:
+            # Writes are staged in memory when the file is closed
+            if 'w' in mode:
+                return GitStagedFile(self, name)
+
+            item = self.tree_item(name)
+
+            if item is None or item.type != 'blob':
+                if 'a' in mode:
+                    return GitStagedFile(self, name)
+
+                raise IOError(u"{0}: Not found in repository".format(name))
+
+            if 'a' in mode:
+                return GitStagedFile(self, name, self.repo[item.sha].data)
+
+            # Reads are served from the HEAD tree
+            return GitBlobFile(self.repo[item.sha], name=name)
+
         abspath = os.path.join(self.repo.workdir, name)
         dirname = os.path.dirname(abspath)
 
         if 'w' in mode and not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        # Stage the file on the next commit
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            with self.staged_lock:
+                self.staged.pop(name, None)
+                self.dirty.add(name)
+
         return GitFile(open(abspath, mode))
 
+    def open_blob(self, name):
+        """
+            Opens the file given by name, as stored in the HEAD tree.
+
+            :param name: Name of the file to open.
+            :type name: unicode
+            :returns: GitBlobFile
+            :raises: IOError
+        """
+
+        item = self.tree_item(name)
+
+        if item is None or item.type != 'blob':
+            raise IOError(u"{0}: Not found in repository".format(name))
+
+        return GitBlobFile(self.repo[item.sha], name=name)
+
     def path(self, name):
         """
             Return the absolute path of the file ``name`` within the repository.
@@ -535,12 +3770,16 @@ class GitStorage(Storage):
             :param name: Name of the file within the repository.
             :type name: unicode
             :returns: str
-            :raises: IOError
+            :raises: IOError, NotImplementedError
         """
 
+        if self.bare:
+            raise NotImplementedError(u"{0}: Bare repository has no working directory".format(name))
+
         if not self.exists(name):
             raise IOError(u"{0}: Not found in repository".format(name))
 
+        self.refresh_index()
         e = self.index[name]
 
         return os.path.join(self.repo.workdir, e.path).decode('utf-8')
@@ -560,6 +3799,19 @@ class GitStorage(Storage):
         """
 
         new_name = self.get_available_name(name)
+
+        try:
+            size = content.size
+
+        except (AttributeError, TypeError, ValueError):
+            size = None
+
+        if self.bare:
+            # Stream the content to the object database
+            self.stage_blob(new_name, self.write_blob(content.chunks(), size))
+
+            return new_name
+
         abspath = os.path.join(self.repo.workdir, new_name)
 
         dirname = os.path.dirname(abspath)
@@ -567,9 +3819,184 @@ class GitStorage(Storage):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        # Write the file and its blob while reading the content once
         with open(abspath, 'wb') as f:
-            for chunk in content.chunks():
-                f.write(chunk)
+            def chunks():
+                for chunk in content.chunks():
+                    f.write(chunk)
+
+                    yield chunk
+
+            oid = self.write_blob(chunks(), size)
+
+        # Stage the file on the next commit
+        with self.staged_lock:
+            self.staged[new_name] = oid
+            self.dirty.add(new_name)
+
+        return new_name
+
+    def stage(self, name, data):
+        """
+            Write a blob, and stage it for the next commit of a bare repository.
+
+            :param name: Name of the file within the repository.
+            :type name: unicode
+            :param data: Content of the file (or None to delete it).
+            :type data: str or None
+            :returns: pygit2.Oid, or None
+        """
+
+        oid = self.repo.create_blob(data) if data is not None else None
+
+        return self.stage_blob(name, oid)
+
+    def stage_blob(self, name, oid):
+        """
+            Stage an existing blob for the next commit of a bare repository.
+
+            :param name: Name of the file within the repository.
+            :type name: unicode
+            :param oid: The blob (or None to delete the file).
+            :type oid: pygit2.Oid or None
+            :returns: pygit2.Oid, or None
+        """
+
+        with self.staged_lock:
+            self.staged[name] = oid
+
+        return oid
+
+    def write_blob(self, chunks, size=None):
+        """
+            Write a blob to the object database, while its content is read.
+
+            The blob is hashed and compressed chunk by chunk into a loose
+            object, so the content is never held in memory nor read twice.
+
+            :param chunks: Content of the blob.
+            :type chunks: iterable of str
+            :param size: Size of the content, if unknown the content is first spooled to a temporary file.
+            :type size: int or None
+            :returns: pygit2.Oid
+            :raises: ValueError
+        """
+
+        if size is None:
+            spool = SpooledTemporaryFile(max_size=CHUNK_SIZE)
+
+            for chunk in chunks:
+                spool.write(chunk)
+
+            size = spool.tell()
+            spool.seek(0)
+
+            chunks = iter(lambda: spool.read(CHUNK_SIZE), b'')
+
+        objects = os.path.join(self.repo.path, 'objects')
+        tmpname = os.path.join(objects, 'tmp_obj_{0}_{1}'.format(os.getpid(), threading.current_thread().ident))
+
+        header = 'blob {0}\0'.format(size).encode('ascii')
+
+        sha = hashlib.sha1(header)
+        compressor = zlib.compressobj()
+        written = 0
+
+        try:
+            with open(tmpname, 'wb') as f:
+                f.write(compressor.compress(header))
+
+                for chunk in chunks:
+                    sha.update(chunk)
+                    f.write(compressor.compress(chunk))
+                    written += len(chunk)
+
+                f.write(compressor.flush())
+
+            if written != size:
+                raise ValueError(u"Expected {0} bytes, got {1}".format(size, written))
+
+            sha = sha.hexdigest()
+            dirname = os.path.join(objects, sha[:2])
+            filename = os.path.join(dirname, sha[2:])
+
+            if not os.path.exists(dirname):
+                try:
+                    os.makedirs(dirname)
+
+                # Created concurrently
+                except OSError:
+                    pass
+
+            # The same content may already be stored
+            if os.path.exists(filename):
+                os.remove(tmpname)
+
+            else:
+                os.chmod(tmpname, 0o444)
+                os.rename(tmpname, filename)
+
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+        return Oid(hex=sha)
+
+    def read_blob(self, sha, chunk_size=CHUNK_SIZE):
+        """
+            Read a blob by chunks.
+
+            Loose objects are decompressed chunk by chunk, packed objects are
+            read through a GitBlobFile.
+
+            :param sha: SHA of the blob.
+            :type sha: unicode
+            :param chunk_size: Maximal size of the chunks to read and to yield.
+            :type chunk_size: int
+            :returns: generator of str
+        """
+
+        sha = to_unicode(sha)
+        filename = os.path.join(self.repo.path, 'objects', sha[:2], sha[2:])
+
+        try:
+            f = open(filename, 'rb')
+
+        except IOError:
+            for chunk in GitBlobFile(self.repo[sha]).chunks(chunk_size):
+                yield chunk
+
+            return
+
+        decompressor = zlib.decompressobj()
+
+        def inflate():
+            for data in iter(lambda: f.read(chunk_size), b''):
+                # Highly compressed data are inflated by parts, so a chunk
+                # never exceeds chunk_size.
+                while data:
+                    yield decompressor.decompress(data, chunk_size)
+                    data = decompressor.unconsumed_tail
+
+            yield decompressor.flush()
+
+        with f:
+            header = b''
+
+            for data in inflate():
+                # Skip the object header
+                if header is not None:
+                    header += data
+                    pos = header.find(b'\0')
+
+                    if pos == -1:
+                        continue
+
+                    data = header[pos + 1:]
+                    header = None
+
+                if data:
+                    yield data
 
     def delete(self, name):
         """
@@ -583,5 +4010,14 @@ class GitStorage(Storage):
         if not self.exists(name):
             raise IOError(u"{0}: Not found in repository".format(name))
 
+        if self.bare:
+            self.stage(name, None)
+            return
+
         abspath = os.path.join(self.repo.workdir, name)
         os.remove(abspath)
+
+        # Stage the deletion on the next commit
+        with self.staged_lock:
+            self.staged.pop(name, None)
+            self.dirty.add(name)
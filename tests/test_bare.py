@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import datetime
+import os
+
+from gitstorage.StorageBackend import GitStorage, GitBlobFile
+from django.core.files.base import ContentFile
+
+
+class TestUser(object):
+    first_name = u'Gérard'
+    last_name = u'Test'
+    email = u'gerard.test@example.com'
+
+
+class TestBare(unittest.TestCase):
+
+    def setUp(self):
+        """
+            Create bare repository, and commit test_é.txt file.
+        """
+
+        self.st = GitStorage.create_storage('test-bare-git', bare=True)
+        self.user = TestUser()
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test/test_é.txt', f)
+        self.commit = self.st.commit(self.user, u'test commit é')
+
+    def tearDown(self):
+        """
+            Remove repository.
+        """
+
+        for root, dirs, files in os.walk(self.st.repo.path, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+
+            for name in dirs:
+                os.rmdir(os.path.join(root, name))
+
+        os.rmdir(self.st.repo.path)
+
+    def test_bare_read(self):
+        """
+            Make sure files are read from the HEAD tree.
+        """
+
+        self.assertTrue(self.st.exists(u'test/test_é.txt'))
+        self.assertTrue(self.st.is_dir(u'test'))
+        self.assertEqual(self.st.size(u'test/test_é.txt'), len(u'héhé'.encode('utf-8')))
+
+        f = self.st.open(u'test/test_é.txt')
+        self.assertEqual(f.read(), u'héhé'.encode('utf-8'))
+        f.close()
+
+        self.assertEqual(([u'test'], []), self.st.listdir())
+        self.assertEqual(
+            [(u'test/test_é.txt', [u'héhé'])],
+            self.st.search(u'hé')
+        )
+
+    def test_bare_times(self):
+        """
+            Make sure times of files and directories come from their commits.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'test/other.txt', f)
+        other = self.st.commit(self.user, u'other commit é')
+
+        for st in (self.st, GitStorage(self.st.repo.path, history_index=False)):
+            self.assertEqual(st.created_time(u'test'), datetime.datetime.fromtimestamp(self.commit.commit_time))
+            self.assertEqual(st.modified_time(u'test'), datetime.datetime.fromtimestamp(other.commit_time))
+            self.assertEqual(
+                [commit.hex for commit in st.log(name=u'test')],
+                [other.hex, self.commit.hex]
+            )
+
+    def test_bare_blob_file(self):
+        """
+            Make sure blob files can be read by parts.
+        """
+
+        data = u'héhé'.encode('utf-8')
+
+        f = self.st.open(u'test/test_é.txt')
+        self.assertIsInstance(f, GitBlobFile)
+        self.assertEqual(f.size, len(data))
+
+        self.assertEqual(f.read(2), data[:2])
+        self.assertEqual(f.read(), data[2:])
+
+        f.seek(-1, os.SEEK_END)
+        self.assertEqual(f.read(), data[-1:])
+
+        self.assertEqual(list(f.chunks(4)), [data[:4], data[4:]])
+        self.assertEqual(f.getbuffer().tobytes(), data)
+
+        f.close()
+        self.assertTrue(f.closed)
+
+    def test_bare_blob_stream(self):
+        """
+            Make sure blobs can be written and read by chunks.
+        """
+
+        chunks = [b'a' * 100000, b'b' * 100000, b'c']
+
+        oid = self.st.write_blob(iter(chunks), 200001)
+        self.assertEqual(self.st.repo[oid].data, b''.join(chunks))
+        self.assertEqual(b''.join(self.st.read_blob(oid.hex, 1024)), b''.join(chunks))
+
+        # Highly compressed data are read by parts
+        oid = self.st.write_blob(iter([b'\0' * 1000000]), 1000000)
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in self.st.read_blob(oid.hex, 1024)))
+
+        # Unknown size
+        oid = self.st.write_blob(iter(chunks))
+        self.assertEqual(self.st.repo[oid].size, 200001)
+
+        self.assertRaises(ValueError, self.st.write_blob, iter(chunks), 10)
+
+    def test_bare_write(self):
+        """
+            Make sure writes are staged until the next commit.
+        """
+
+        f = self.st.open(u'other.txt', 'w')
+        f.write(u'hoho')
+        f.close()
+
+        self.st.delete(u'test/test_é.txt')
+
+        self.assertFalse(self.st.exists(u'other.txt'))
+        self.assertTrue(self.st.exists(u'test/test_é.txt'))
+
+        commit = self.st.commit(self.user, u'other commit é')
+
+        self.assertEqual(commit.parents[0].hex, self.commit.hex)
+        self.assertTrue(self.st.exists(u'other.txt'))
+        self.assertFalse(self.st.exists(u'test/test_é.txt'))
+        self.assertFalse(self.st.exists(u'test'))
+        self.assertEqual(self.st.staged, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import threading
 import os
 
-from gitstorage.StorageBackend import GitStorage, GitFile
+from gitstorage.StorageBackend import GitStorage, GitFile, get_tree_entry
 from django.core.files.base import ContentFile
 
 
@@ -68,5 +69,172 @@ class TestCommitFile(unittest.TestCase):
 
         self.st.commit(self.user, u'test commit é')
 
+    def test_commit_dirty_files(self):
+        """
+            Test that only files written through the storage are committed.
+        """
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test_é.txt', f)
+
+        # Written outside of the storage
+        with open(os.path.join(self.st.repo.workdir, 'external.txt'), 'wb') as f:
+            f.write(b'hoho')
+
+        self.st.commit(self.user, u'test commit é')
+
+        self.assertTrue(self.st.exists(u'test_é.txt'))
+        self.assertFalse(self.st.exists(u'external.txt'))
+        self.assertEqual(self.st.dirty, set())
+
+        self.st.delete(u'test_é.txt')
+        self.st.commit(self.user, u'delete commit é', full_scan=True)
+
+        self.assertFalse(self.st.exists(u'test_é.txt'))
+        self.assertTrue(self.st.exists(u'external.txt'))
+
+    def test_commit_without_index(self):
+        """
+            Test that the index is updated lazily after a commit.
+        """
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test/test_é.txt', f)
+        commit = self.st.commit(self.user, u'test commit é')
+
+        self.assertEqual(self.st.index_head(), u'')
+        self.assertEqual(commit.tree[u'test/test_é.txt'].hex, self.st.tree_item(u'test/test_é.txt').sha)
+
+        # The index is also synchronized by other storages
+        st = GitStorage(self.st.repo.workdir)
+        paths = [entry.path.decode('utf-8') for entry in st.walk()]
+
+        self.assertEqual(paths, [u'test/test_é.txt'])
+        self.assertEqual(self.st.index_head(), commit.hex)
+
+    def test_commit_without_index_missing_file(self):
+        """
+            Test that a full scan keeps committed files missing from the working directory.
+        """
+
+        oid = self.st.write_blob(iter([b'hehe']), 4)
+        self.st.apply_changes(self.user, u'test commit é', {u'test_é.txt': oid})
+
+        # The committing process was interrupted before writing the file
+        abspath = os.path.join(self.st.repo.workdir, u'test_é.txt')
+        os.remove(abspath)
+
+        with open(os.path.join(self.st.repo.workdir, 'external.txt'), 'wb') as f:
+            f.write(b'hoho')
+
+        other = GitStorage(self.st.repo.workdir)
+        last = other.commit(self.user, u'other commit é')
+
+        self.assertIsNotNone(get_tree_entry(last.tree, u'test_é.txt'))
+        self.assertIsNotNone(get_tree_entry(last.tree, u'external.txt'))
+
+        with open(abspath, 'rb') as f:
+            self.assertEqual(f.read(), b'hehe')
+
+    def test_commit_without_index_concurrent(self):
+        """
+            Test that storages reading concurrently synchronize the index once.
+        """
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test/test_é.txt', f)
+        commit = self.st.commit(self.user, u'test commit é')
+
+        storages = [GitStorage(self.st.repo.workdir) for i in range(4)]
+        results = []
+        errors = []
+
+        def walk(st):
+            try:
+                results.append([entry.path.decode('utf-8') for entry in st.walk()])
+
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=walk, args=(st,)) for st in storages]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [[u'test/test_é.txt']] * 4)
+        self.assertEqual(self.st.index_head(), commit.hex)
+
+    def test_commit_concurrent(self):
+        """
+            Test that commits of concurrent storages are never lost.
+        """
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test_é.txt', f)
+        first = self.st.commit(self.user, u'test commit é')
+
+        other = GitStorage(self.st.repo.workdir)
+        other.save(u'other.txt', ContentFile(b'hoho'))
+        second = other.commit(self.user, u'other commit é')
+
+        # The branch doesn't point to the first commit anymore
+        self.assertFalse(self.st.update_head(first.hex, first.oid))
+
+        self.st.save(u'last.txt', ContentFile(b'hihi'))
+        last = self.st.commit(self.user, u'last commit é')
+
+        self.assertEqual(last.parents[0].hex, second.hex)
+        self.assertTrue(self.st.exists(u'other.txt'))
+        self.assertTrue(self.st.exists(u'test_é.txt'))
+
+    def test_commit_branch_moved(self):
+        """
+            Test that a commit is applied again when the branch moves before updating HEAD.
+        """
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test_é.txt', f)
+        self.st.commit(self.user, u'test commit é')
+
+        other = GitStorage(self.st.repo.workdir)
+        update_head = self.st.update_head
+        names = [u'other_2.txt', u'other_1.txt']
+        moved = []
+
+        def move_and_update_head(expected, commit):
+            # Another storage commits after HEAD was read
+            if not moved:
+                other.save(names.pop(), ContentFile(b'hoho'))
+                moved.append(other.commit(self.user, u'other commit é'))
+
+            return update_head(expected, commit)
+
+        self.st.update_head = move_and_update_head
+
+        # Commit without the index
+        self.st.save(u'last.txt', ContentFile(b'hihi'))
+        last = self.st.commit(self.user, u'last commit é')
+
+        self.assertEqual(last.parents[0].hex, moved[0].hex)
+
+        for path in (u'test_é.txt', u'other_1.txt', u'last.txt'):
+            self.assertIsNotNone(get_tree_entry(last.tree, path))
+
+        # Commit with the index
+        del moved[:]
+
+        self.st.save(u'scan.txt', ContentFile(b'haha'))
+        last = self.st.commit(self.user, u'scan commit é', full_scan=True)
+
+        self.assertEqual(last.parents[0].hex, moved[0].hex)
+
+        for path in (u'test_é.txt', u'other_1.txt', u'other_2.txt', u'last.txt', u'scan.txt'):
+            self.assertIsNotNone(get_tree_entry(last.tree, path))
+
+
 if __name__ == '__main__':
     unittest.main()
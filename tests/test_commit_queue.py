@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import threading
+import time
+import os
+
+from gitstorage.StorageBackend import GitStorage, GitCommitQueue
+from django.core.files.base import ContentFile
+
+
+class TestUser(object):
+    first_name = u'Gérard'
+    last_name = u'Test'
+    email = u'gerard.test@example.com'
+
+
+class OtherUser(object):
+    first_name = u'Other'
+    last_name = u'Test'
+    email = u'other.test@example.com'
+
+
+class TestCommitQueue(unittest.TestCase):
+
+    def setUp(self):
+        """
+            Create repository, and commit test_é.txt file.
+        """
+
+        self.st = GitStorage.create_storage('test-commit-queue-git')
+        self.user = TestUser()
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test_é.txt', f)
+        self.commit = self.st.commit(self.user, u'test commit é')
+
+        self.queue = GitCommitQueue(self.st, window=10)
+
+    def tearDown(self):
+        """
+            Stop the queue, and remove repository.
+        """
+
+        self.queue.close()
+
+        for root, dirs, files in os.walk(self.st.repo.workdir, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+
+            for name in dirs:
+                os.rmdir(os.path.join(root, name))
+
+        os.rmdir(self.st.repo.workdir)
+
+    def test_group_commit(self):
+        """
+            Make sure writes of an author are grouped in one commit.
+        """
+
+        t1 = self.queue.save(self.user, u'first é', u'a.txt', ContentFile(b'a'))
+        t2 = self.queue.save(self.user, u'second é', u'b.txt', ContentFile(b'b'))
+        t3 = self.queue.delete(self.user, u'second é', u'test_é.txt')
+
+        self.assertTrue(self.queue.flush(timeout=10))
+
+        commit = t1.wait()
+
+        self.assertEqual(commit.hex, t2.wait().hex)
+        self.assertEqual(commit.hex, t3.wait().hex)
+        self.assertEqual(commit.parents[0].hex, self.commit.hex)
+        self.assertEqual(commit.message, u'first é\n\nsecond é')
+
+        self.assertTrue(self.st.exists(u'a.txt'))
+        self.assertTrue(self.st.exists(u'b.txt'))
+        self.assertFalse(self.st.exists(u'test_é.txt'))
+
+        with open(os.path.join(self.st.repo.workdir, 'b.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'b')
+
+    def test_commit_per_author(self):
+        """
+            Make sure each author gets a commit.
+        """
+
+        t1 = self.queue.save(self.user, u'first é', u'a.txt', ContentFile(b'a'))
+        t2 = self.queue.save(OtherUser(), u'other', u'b.txt', ContentFile(b'b'))
+
+        self.assertTrue(self.queue.flush(timeout=10))
+
+        self.assertNotEqual(t1.wait().hex, t2.wait().hex)
+        self.assertEqual(len(self.st.log(limit=-1)), 3)
+
+    def test_flush_during_commit(self):
+        """
+            Make sure flush() waits for the writes being committed.
+        """
+
+        started = threading.Event()
+        apply_changes = self.st.apply_changes
+
+        def slow_apply_changes(*args):
+            started.set()
+            time.sleep(0.5)
+
+            return apply_changes(*args)
+
+        self.st.apply_changes = slow_apply_changes
+
+        queue = GitCommitQueue(self.st, window=0)
+
+        try:
+            ticket = queue.save(self.user, u'slow', u'a.txt', ContentFile(b'a'))
+
+            self.assertTrue(started.wait(10))
+            self.assertTrue(queue.flush(timeout=10))
+            self.assertTrue(ticket.event.is_set())
+            self.assertFalse(queue.flushing)
+
+        finally:
+            queue.close()
+
+        self.assertTrue(self.st.exists(u'a.txt'))
+
+
+    def test_flush_error(self):
+        """
+            Make sure flush() reports failed writes.
+        """
+
+        def failing_apply_changes(*args):
+            raise IOError(u"Disk full")
+
+        self.st.apply_changes = failing_apply_changes
+
+        ticket = self.queue.save(self.user, u'failing', u'a.txt', ContentFile(b'a'))
+
+        self.assertFalse(self.queue.flush(timeout=10))
+        self.assertRaises(IOError, ticket.wait)
+        self.assertFalse(self.st.exists(u'a.txt'))
+
+if __name__ == '__main__':
+    unittest.main()
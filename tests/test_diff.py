@@ -47,6 +47,17 @@ class TestDiff(unittest.TestCase):
 
         os.rmdir(self.st.repo.workdir)
 
+    def objects(self):
+        """
+            Get the files of the object database.
+        """
+
+        return sorted(
+            os.path.join(root, name)
+            for root, dirs, files in os.walk(os.path.join(self.st.repo.path, 'objects'))
+            for name in files
+        )
+
     def test_diff(self):
         """
             Make sure the diff is correct.
@@ -66,6 +77,108 @@ index 0000000..ffe3c60
 
         self.assertEqual(d, patch)
 
+    def test_diff_file(self):
+        """
+            Make sure the diff of a file is correct.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'test/other.txt', f)
+        commit3 = self.st.commit(self.user, u'other commit')
+
+        f = self.st.open(u'test/other.txt', 'w')
+        f.write(u'hihi')
+        f.close()
+
+        commit4 = self.st.commit(self.user, u'last commit')
+
+        objects = self.objects()
+
+        d = self.st.diff(commit3.oid, commit4.oid, u'test/other.txt')
+
+        self.assertIn(u'-hoho', d)
+        self.assertIn(u'+hihi', d)
+
+        # A diff doesn't write objects
+        self.assertEqual(objects, self.objects())
+
+        # The file didn't change
+        self.assertEqual(self.st.diff(commit3.oid, commit4.oid, u'test_é.txt'), u'')
+
+    def test_iter_diff(self):
+        """
+            Make sure the diff can be streamed, and limited.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'test/other.txt', f)
+        f = ContentFile(u'haha'.encode('utf-8'))
+        self.st.save(u'test/another.txt', f)
+        commit3 = self.st.commit(self.user, u'other commit')
+
+        # Same patch as diff()
+        self.assertEqual(
+            u''.join(self.st.iter_diff(self.commit1.oid, self.commit2.oid)),
+            self.st.diff(self.commit1.oid, self.commit2.oid)
+        )
+
+        d = u''.join(self.st.iter_diff(self.commit2.oid, commit3.oid))
+
+        self.assertEqual(d, self.st.diff(self.commit2.oid, commit3.oid))
+        self.assertIn(u'+++ b/test/other.txt', d)
+        self.assertIn(u'+++ b/test/another.txt', d)
+        self.assertIn(u'+hoho', d)
+        self.assertIn(u'+haha', d)
+
+        d = u''.join(self.st.iter_diff(self.commit2.oid, commit3.oid, max_files=1))
+
+        self.assertEqual(d.count(u'diff --git'), 1)
+
+        d = u''.join(self.st.iter_diff(self.commit2.oid, commit3.oid, max_bytes=100))
+
+        self.assertTrue(len(d.encode('utf-8')) <= 100)
+
+        d = u''.join(self.st.iter_diff(self.commit2.oid, commit3.oid, u'test/other.txt'))
+
+        self.assertEqual(d.count(u'diff --git'), 1)
+        self.assertIn(u'+hoho', d)
+
+    def test_diff_cache(self):
+        """
+            Make sure diffs are cached.
+        """
+
+        d = self.st.diff(self.commit1.oid, self.commit2.oid)
+
+        self.assertEqual(len(self.st.diff_cache), 1)
+        self.assertEqual(d, self.st.diff(self.commit1.hex, self.commit2.hex))
+        self.assertEqual(len(self.st.diff_cache), 1)
+
+        self.st.diff(self.commit1.oid, self.commit2.oid, u'test_é_1.txt')
+        self.assertEqual(len(self.st.diff_cache), 2)
+
+        # Large diffs are not kept in memory
+        st = GitStorage(self.st.repo.workdir, diff_cache_weight=10)
+        st.diff(self.commit1.oid, self.commit2.oid)
+
+        self.assertEqual(len(st.diff_cache), 0)
+
+    def test_diff_custom_cache(self):
+        """
+            Make sure diffs can be cached by any object providing get() and set().
+        """
+
+        class Cache(dict):
+            def set(self, key, value):
+                self[key] = value
+
+        cache = Cache()
+        st = GitStorage(self.st.repo.workdir, diff_cache=cache)
+
+        d = st.diff(self.commit1.oid, self.commit2.oid)
+
+        self.assertEqual(list(cache.values()), [d])
+
     def test_diffs(self):
         """
             Make sure the method returns correct data.
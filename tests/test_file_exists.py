@@ -55,6 +55,19 @@ class TestFileExists(unittest.TestCase):
 
         self.assertFalse(self.st.exists(u'test_oups.txt'))
 
+    def test_file_exists_after_commit(self):
+        """
+            Make sure cached lookups are invalidated by a new commit.
+        """
+
+        self.assertFalse(self.st.exists(u'test_oups.txt'))
+
+        f = ContentFile(u'oups'.encode('utf-8'))
+        self.st.save(u'test_oups.txt', f)
+        self.st.commit(self.user, u'oups commit é')
+
+        self.assertTrue(self.st.exists(u'test_oups.txt'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -53,6 +53,58 @@ class TestListdir(unittest.TestCase):
 
         self.assertEqual(listdir, self.st.listdir())
 
+    def test_listdir_tree_and_index(self):
+        """
+            Make sure the HEAD tree and the index are listed like the working directory.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'test/other_é.txt', f)
+        self.st.commit(self.user, u'other commit é')
+
+        # Untracked files are not listed
+        f = ContentFile(u'hihi'.encode('utf-8'))
+        self.st.save(u'untracked.txt', f)
+
+        listdir = (
+            [u'test'],
+            [u'test_é.txt'],
+        )
+
+        self.assertEqual(listdir, self.st.listdir(source='tree'))
+        self.assertEqual(listdir, self.st.listdir(source='tree'))
+        self.assertEqual(listdir, self.st.listdir(source='index'))
+
+        listdir = (
+            [],
+            [u'other_é.txt'],
+        )
+
+        self.assertEqual(listdir, self.st.listdir(u'test', source='tree'))
+        self.assertEqual(listdir, self.st.listdir(u'test', source='index'))
+
+
+    def test_listdir_page(self):
+        """
+            Make sure directories can be listed page by page.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'test/other_é.txt', f)
+        self.st.save(u'a.txt', f)
+        self.st.commit(self.user, u'other commit é')
+
+        entries, cursor = self.st.listdir_page(limit=2)
+        self.assertEqual(entries, [(u'a.txt', 'blob'), (u'test', 'tree')])
+        self.assertIsNotNone(cursor)
+
+        entries, cursor = self.st.listdir_page(limit=2, cursor=cursor)
+        self.assertEqual(entries, [(u'test_é.txt', 'blob')])
+        self.assertIsNone(cursor)
+
+        entries, cursor = self.st.listdir_page(limit=10, order='time')
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(entries[-1], (u'test_é.txt', 'blob'))
 
 if __name__ == '__main__':
     unittest.main()
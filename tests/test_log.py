@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import json
 import os
 
 from gitstorage.StorageBackend import GitStorage
@@ -70,5 +71,187 @@ class TestLog(unittest.TestCase):
 
         self.assertEqual(len(commits), 1)
 
+    def test_commit_log_for_file_indexed(self):
+        """
+            Verify that the history index is updated by new commits.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'test/other_é.txt', f)
+        other = self.st.commit(self.user, u'other commit é')
+
+        # Build the index
+        self.st.log(name=u'test_é.txt')
+        self.assertTrue(self.st.history.exists())
+
+        with open(self.st.history.filename, 'rb') as f:
+            before = f.read()
+
+        f = ContentFile(u'hihi'.encode('utf-8'))
+        self.st.save(u'test/other_é.txt', f)
+        last = self.st.commit(self.user, u'last commit é')
+
+        commits = [commit.hex for commit in self.st.log(name=u'test/other_é.txt')]
+        self.assertEqual(commits, [last.hex, other.hex])
+
+        # The new commit is appended to the index
+        with open(self.st.history.filename, 'rb') as f:
+            after = f.read()
+
+        self.assertTrue(after.startswith(before))
+        self.assertEqual(after.count(b'\n'), before.count(b'\n') + 1)
+
+        st = GitStorage(self.st.repo.workdir)
+        commits = [commit.hex for commit in st.log(name=u'test/other_é.txt')]
+        self.assertEqual(commits, [last.hex, other.hex])
+
+        commits = [commit.hex for commit in self.st.log(name=u'test_é.txt')]
+        self.assertEqual(commits, [self.commit.hex])
+
+    def test_commit_log_index_interrupted(self):
+        """
+            Verify that the record of an interrupted process is dropped from the history index.
+        """
+
+        # Build the index
+        self.st.log(name=u'test_é.txt')
+
+        with open(self.st.history.filename, 'ab') as f:
+            f.write(b'{"head": "0000')
+
+        st = GitStorage(self.st.repo.workdir)
+        st.save(u'other.txt', ContentFile(b'hoho'))
+        other = st.commit(self.user, u'other commit é')
+
+        st = GitStorage(self.st.repo.workdir)
+        commits = [commit.hex for commit in st.log(name=u'other.txt')]
+        self.assertEqual(commits, [other.hex])
+
+        with open(self.st.history.filename, 'rb') as f:
+            lines = f.read().split(b'\n')
+
+        self.assertEqual(lines[-1], b'')
+
+        for line in lines[:-1]:
+            json.loads(line.decode('utf-8'))
+
+    def test_commit_log_for_file_not_indexed(self):
+        """
+            Verify the history of a file without the history index.
+        """
+
+        st = GitStorage(self.st.repo.workdir, history_index=False)
+
+        real_commits = [self.commit.hex]
+        commits = [commit.hex for commit in st.log(name=u'test_é.txt')]
+
+        self.assertEqual(commits, real_commits)
+
+    def test_commit_log_for_nested_file_not_indexed(self):
+        """
+            Verify the history of a file in a subdirectory, without the history index.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'test/other_é.txt', f)
+        other = self.st.commit(self.user, u'other commit é')
+
+        f = ContentFile(u'hihi'.encode('utf-8'))
+        self.st.save(u'test/last_é.txt', f)
+        self.st.commit(self.user, u'last commit é')
+
+        st = GitStorage(self.st.repo.workdir, history_index=False)
+
+        commits = [commit.hex for commit in st.log(name=u'test/other_é.txt')]
+        self.assertEqual(commits, [other.hex])
+
+    def test_commit_log_graph(self):
+        """
+            Verify that history walked through the commit graph is correct.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'other_é.txt', f)
+        other = self.st.commit(self.user, u'other commit é')
+
+        commits = [commit.hex for commit in self.st.log(limit=-1)]
+        self.assertEqual(commits, [other.hex, self.commit.hex])
+        self.assertTrue(self.st.graph.exists())
+
+        # New commits are added to the graph
+        f = ContentFile(u'hihi'.encode('utf-8'))
+        self.st.save(u'other_é.txt', f)
+        last = self.st.commit(self.user, u'last commit é')
+
+        self.assertEqual(self.st.graph.commits[last.hex][1], 3)
+
+        st = GitStorage(self.st.repo.workdir, commit_graph=False)
+
+        commits = [commit.hex for commit in self.st.log(limit=-1)]
+        self.assertEqual(commits, [commit.hex for commit in st.log(limit=-1)])
+
+    def test_commit_log_graph_interrupted(self):
+        """
+            Verify that the record of an interrupted process is dropped from the commit graph.
+        """
+
+        # Build the graph
+        self.st.log(limit=-1)
+
+        size = os.path.getsize(self.st.graph.filename)
+
+        with open(self.st.graph.filename, 'ab') as f:
+            f.write(b'\0' * 30)
+
+        st = GitStorage(self.st.repo.workdir)
+        st.save(u'other.txt', ContentFile(b'hoho'))
+        other = st.commit(self.user, u'other commit é')
+
+        # The new record replaces the incomplete one
+        self.assertEqual(os.path.getsize(self.st.graph.filename), size + st.graph.RECORD.size + 20)
+
+        st = GitStorage(self.st.repo.workdir)
+        st.graph.load()
+
+        self.assertEqual(st.graph.commits[other.hex][1], 2)
+
+        commits = [commit.hex for commit in st.log(limit=-1)]
+        self.assertEqual(commits, [other.hex, self.commit.hex])
+
+    def test_commit_log_pages(self):
+        """
+            Verify that history can be walked page by page.
+        """
+
+        f = ContentFile(u'hoho'.encode('utf-8'))
+        self.st.save(u'other_é.txt', f)
+        other = self.st.commit(self.user, u'other commit é')
+
+        f = ContentFile(u'hihi'.encode('utf-8'))
+        self.st.save(u'other_é.txt', f)
+        last = self.st.commit(self.user, u'last commit é')
+
+        expected = [last.hex, other.hex, self.commit.hex]
+
+        for st in (self.st, GitStorage(self.st.repo.workdir, history_index=False, commit_graph=False)):
+            commits, cursor = st.log_page(limit=2)
+            self.assertEqual([c.hex for c in commits], expected[:2])
+
+            commits, cursor = st.log_page(limit=2, after=cursor)
+            self.assertEqual([c.hex for c in commits], expected[2:])
+            self.assertIsNone(cursor)
+
+            commits, cursor = st.log_page(name=u'other_é.txt', limit=1)
+            self.assertEqual([c.hex for c in commits], expected[:1])
+
+            commits = st.log(name=u'other_é.txt', limit=1, after=cursor)
+            self.assertEqual([c.hex for c in commits], expected[1:2])
+
+            self.assertRaises(ValueError, st.log, after=cursor)
+
+        diffs = self.st.diffs(limit=1)
+        self.assertIsNotNone(diffs['next'])
+        self.assertEqual(self.st.diffs(limit=1, after=diffs['next'])['diffs'][0]['sha'], other.hex)
+
 if __name__ == '__main__':
     unittest.main()
@@ -74,5 +74,165 @@ class TestSearch(unittest.TestCase):
 
         self.assertEqual(expected, results)
 
+    def test_search_index_update(self):
+        """
+            Make sure new blobs are found through the search index.
+        """
+
+        # Build the index
+        self.st.search(u'hé')
+
+        f = ContentFile(u'foo\nbarhé\n'.encode('utf-8'))
+        self.st.save(u'other_é.txt', f)
+        self.st.commit(self.user, u'other commit é')
+
+        expected = [
+            (u'other_é.txt', [u'barhé'])
+        ]
+
+        results = self.st.search(u'rhé')
+
+        self.assertEqual(expected, results)
+
+    def test_search_index_append(self):
+        """
+            Make sure a commit only appends its new blobs to the search index.
+        """
+
+        # Build the index
+        self.st.search(u'hé')
+
+        with open(self.st.search_index.filename, 'rb') as f:
+            before = f.read()
+
+        f = ContentFile(u'foo\nbarhé\n'.encode('utf-8'))
+        self.st.save(u'other_é.txt', f)
+        self.st.commit(self.user, u'other commit é')
+
+        with open(self.st.search_index.filename, 'rb') as f:
+            after = f.read()
+
+        self.assertTrue(after.startswith(before))
+        self.assertEqual(after.count(b'\n'), before.count(b'\n') + 1)
+
+    def test_search_index_latin1(self):
+        """
+            Make sure files which aren't UTF-8 are found through the search index.
+        """
+
+        f = ContentFile(u'caf\xe9\nlatin text\n'.encode('latin-1'))
+        self.st.save(u'latin.txt', f)
+        self.st.commit(self.user, u'latin commit')
+
+        expected = [
+            (u'latin.txt', [u'latin text'])
+        ]
+
+        self.assertEqual(self.st.search(u'tin te'), expected)
+        self.assertEqual(GitStorage(self.st.repo.workdir, search_index=False).search(u'tin te'), expected)
+
+    def test_search_not_indexed(self):
+        """
+            Make sure the search works without the search index.
+        """
+
+        st = GitStorage(self.st.repo.workdir, search_index=False)
+
+        expected = [
+            (u'test_é.txt', [u'héhé'])
+        ]
+
+        results = st.search(u'héh')
+
+        self.assertEqual(expected, results)
+
+    def test_search_workers(self):
+        """
+            Make sure the search with a pool of threads keeps the files order.
+        """
+
+        for i in range(5):
+            f = ContentFile(u'héhé {0}'.format(i).encode('utf-8'))
+            self.st.save(u'test_{0}.txt'.format(i), f)
+
+        self.st.commit(self.user, u'other commit é')
+
+        results = self.st.search(u'hé', workers=4)
+
+        self.assertEqual(results, self.st.search(u'hé'))
+        self.assertEqual(len(results), 6)
+
+    def test_iter_search_limit(self):
+        """
+            Make sure the search stops after ``limit`` files and ``max_lines`` lines.
+        """
+
+        f = ContentFile(u'héhé\nhéhé\nhéhé\n'.encode('utf-8'))
+        self.st.save(u'test_lines.txt', f)
+        self.st.commit(self.user, u'other commit é')
+
+        results = list(self.st.iter_search(u'hé', limit=1, max_lines=2))
+
+        self.assertEqual(results, [(u'test_lines.txt', [u'héhé', u'héhé'])])
+
+    def test_search_binary(self):
+        """
+            Make sure binary files are ignored.
+        """
+
+        f = ContentFile(b'h\xc3\xa9\x00\xff\xfe')
+        self.st.save(u'test.bin', f)
+        self.st.commit(self.user, u'other commit é')
+
+        expected = [
+            (u'test_é.txt', [u'héhé'])
+        ]
+
+        results = self.st.search(u'hé')
+
+        self.assertEqual(expected, results)
+
+    def test_search_regex(self):
+        """
+            Make sure regular expressions are matched against the text.
+        """
+
+        expected = [
+            (u'test_é.txt', [u'héhé'])
+        ]
+
+        results = self.st.search(u'^h.h.$', regex=True)
+
+        self.assertEqual(expected, results)
+
+    def test_search_many_patterns(self):
+        """
+            Make sure a file matching any of the patterns is found.
+        """
+
+        f = ContentFile(u'foo\nbar\nbaz\n'.encode('utf-8'))
+        self.st.save(u'other.txt', f)
+        self.st.commit(self.user, u'other commit é')
+
+        expected = [
+            (u'other.txt', [u'foo', u'baz']),
+            (u'test_é.txt', [u'héhé']),
+        ]
+
+        results = self.st.search([u'foo', u'baz', u'éh'])
+
+        self.assertEqual(expected, results)
+
+    def test_search_cache(self):
+        """
+            Make sure searched blobs are cached.
+        """
+
+        results = self.st.search(u'hé')
+
+        self.assertEqual(len(self.st.search_cache), 1)
+        self.assertEqual(results, self.st.search(u'hé'))
+        self.assertEqual(len(self.st.search_cache), 1)
+
 if __name__ == '__main__':
     unittest.main()
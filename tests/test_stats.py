@@ -104,5 +104,25 @@ class TestStats(unittest.TestCase):
 
         self.assertEqual('text/plain', self.st.mimetype(u'test/test_é.txt'))
 
+    def test_stat_many(self):
+        """
+            Test the metadata returned by stat_many().
+        """
+
+        stats = self.st.stat_many([u'test', u'test/test_é.txt', u'non-existent'])
+
+        self.assertEqual(stats[u'test'].type, 'tree')
+        self.assertEqual(stats[u'test'].mimetype, 'inode/directory')
+
+        st = stats[u'test/test_é.txt']
+        self.assertEqual(st.type, 'blob')
+        self.assertEqual(st.size, self.f.size)
+        self.assertEqual(st.mimetype, 'text/plain')
+
+        mtime = datetime(st.mtime.year, st.mtime.month, st.mtime.day, st.mtime.hour, st.mtime.minute)
+        self.assertEqual(self.now, mtime)
+
+        self.assertIsNone(stats[u'non-existent'])
+
 if __name__ == '__main__':
     unittest.main()
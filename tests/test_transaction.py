@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+
+from gitstorage.StorageBackend import GitStorage
+from django.core.files.base import ContentFile
+
+
+class TestUser(object):
+    first_name = u'Gérard'
+    last_name = u'Test'
+    email = u'gerard.test@example.com'
+
+
+class TestTransaction(unittest.TestCase):
+
+    def setUp(self):
+        """
+            Create repository, and commit test_é.txt file.
+        """
+
+        self.st = GitStorage.create_storage('test-transaction-git')
+        self.user = TestUser()
+
+        f = ContentFile(u'héhé'.encode('utf-8'))
+        self.st.save(u'test_é.txt', f)
+        self.commit = self.st.commit(self.user, u'test commit é')
+
+    def tearDown(self):
+        """
+            Remove repository.
+        """
+
+        for root, dirs, files in os.walk(self.st.repo.workdir, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+
+            for name in dirs:
+                os.rmdir(os.path.join(root, name))
+
+        os.rmdir(self.st.repo.workdir)
+
+    def test_transaction(self):
+        """
+            Make sure a transaction produces a single commit.
+        """
+
+        with self.st.transaction(self.user, u'import é') as tx:
+            for i in range(10):
+                f = ContentFile(u'héhé {0}'.format(i).encode('utf-8'))
+                tx.save(u'import/test_{0}.txt'.format(i), f)
+
+            tx.delete(u'test_é.txt')
+
+        self.assertEqual(tx.commit.parents[0].hex, self.commit.hex)
+        self.assertEqual(len(self.st.log(limit=-1)), 2)
+
+        self.assertFalse(self.st.exists(u'test_é.txt'))
+        self.assertEqual(self.st.listdir(u'import', source='tree')[1][:2], [u'test_0.txt', u'test_1.txt'])
+
+        # The working directory is updated
+        self.assertFalse(os.path.exists(os.path.join(self.st.repo.workdir, u'test_é.txt')))
+
+        with open(os.path.join(self.st.repo.workdir, u'import/test_9.txt'), 'rb') as f:
+            self.assertEqual(f.read(), u'héhé 9'.encode('utf-8'))
+
+    def test_transaction_error(self):
+        """
+            Make sure a transaction is discarded on error.
+        """
+
+        try:
+            with self.st.transaction(self.user, u'import é') as tx:
+                tx.save(u'other.txt', ContentFile(b'hoho'))
+
+                raise ValueError('abort')
+
+        except ValueError:
+            pass
+
+        self.assertIsNone(tx.commit)
+        self.assertEqual(self.st.log()[0].hex, self.commit.hex)
+        self.assertFalse(self.st.exists(u'other.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()